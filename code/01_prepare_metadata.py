@@ -20,16 +20,34 @@
 
 # %%
 import os
+import sys
 import requests
 import html
 import pandas as pd
 
-from utils import get_dcml_files
+from manifest import get_manifest
+from metadata_cache import cached_table, is_stage_up_to_date, read_sortable_table, record_stage
+from utils import hash_sources
 
 cwd = os.path.abspath('')
 print(f"Changing the current working directory to {cwd}")
 os.chdir(cwd)
 
+BCT_SOURCE = "BCT_html_source"
+KRN_INDEX = "../craigsapp_krn/index.hmd"
+PARSING_CODE = ["01_prepare_metadata.py", "metadata_cache.py"]
+INPUTS = [BCT_SOURCE, KRN_INDEX] + PARSING_CODE
+OUTPUTS = ["riemenschneider.csv", "krn_metadata.csv", "krn_metadata_dtypes.csv"]
+# If True, the script stops right away if neither the inputs (including the names of the DCML files) nor the outputs
+# have changed since the last run. Only when run as a script: in Jupyter, sys.exit() would interrupt the notebook.
+SKIP_IF_UNCHANGED = "ipykernel" not in sys.modules
+
+cap_files = get_manifest("../data").get_files('cap', 'score')
+CAP_FILENAMES = [os.path.basename(path) for path in cap_files.values()]
+if SKIP_IF_UNCHANGED and is_stage_up_to_date("prepare_metadata", INPUTS, OUTPUTS, keys=CAP_FILENAMES):
+    print("Inputs and outputs unchanged since the last run, nothing to do.")
+    sys.exit()
+
 
 # %% [markdown]
 # ## Reading the table from bach-corales.com
@@ -54,39 +72,44 @@ def get_table(url_or_html,
     return table
     
 # the file was created by copying the HTML source code for the table from http://www.bach-chorales.com/BachChoraleTable.htm
-# This detour was taken because pandas was unable to read it entirely directly from the URL
+# This detour was taken because pandas was unable to read it entirely directly from the URL.
+# read_sortable_table() yields the same as get_table(table_source) but parses only the table and the result is cached
+# until the file changes (see metadata_cache.py).
 print(f"Reading the table from http://www.bach-chorales.com/BachChoraleTable.htm")
-with open("BCT_html_source", "r") as f:
-    table_source = f.read()
-
 # bct = get_table("http://www.bach-chorales.com/BachChoraleTable.htm")
-bct = get_table(table_source)
+# the cached tables are invalidated by changes to the parsing code, too
+CODE_HASH = hash_sources(PARSING_CODE)
+bct = cached_table("bct", [BCT_SOURCE], lambda: read_sortable_table(BCT_SOURCE), keys=[CODE_HASH])
 bct
 
 # %% [markdown]
 # ## Reading in metadata from craigsapp/bach-370-chorales
 
 # %%
-print("Reading ../craigsapp_krn/index.hmd")
-krn_table = pd.read_csv("../craigsapp_krn/index.hmd", sep='\t', skiprows=2)
-krn_table.columns = [c.strip("* ") for c in krn_table.columns]
-info_regex = r"<link>(?P<title>.*?)<\/link>(?:, <small>(?:BWV )?(?P<bwv1>\d+)\/?(?P<bwv2>\d+)?.*?<\/small>)? *(?:\((?P<mode>\S+?)\))?"
-expanded_description = krn_table.description.map(html.unescape).str.extract(info_regex)
-bwv = expanded_description.bwv1 + ('.' + expanded_description.bwv2).fillna('')
-krn_metadata = pd.concat([krn_table.iloc[:, :-1], bwv.rename('bwv'), expanded_description], axis=1).iloc[:-1]
-krn_metadata.index = krn_metadata.sort.map(int).rename('Riemenschneider')
+def read_krn_metadata(filepath=KRN_INDEX):
+    krn_table = pd.read_csv(filepath, sep='\t', skiprows=2)
+    krn_table.columns = [c.strip("* ") for c in krn_table.columns]
+    info_regex = r"<link>(?P<title>.*?)<\/link>(?:, <small>(?:BWV )?(?P<bwv1>\d+)\/?(?P<bwv2>\d+)?.*?<\/small>)? *(?:\((?P<mode>\S+?)\))?"
+    expanded_description = krn_table.description.map(html.unescape).str.extract(info_regex)
+    bwv = expanded_description.bwv1 + ('.' + expanded_description.bwv2).fillna('')
+    krn_metadata = pd.concat([krn_table.iloc[:, :-1], bwv.rename('bwv'), expanded_description], axis=1).iloc[:-1]
+    krn_metadata.index = krn_metadata.sort.map(int).rename('Riemenschneider')
+    return krn_metadata
+
+print(f"Reading {KRN_INDEX}")
+krn_metadata = cached_table("krn_metadata", [KRN_INDEX], read_krn_metadata, keys=[CODE_HASH])
 krn_metadata.dtypes.to_frame('dtypes').to_csv("krn_metadata_dtypes.csv")
 krn_metadata.to_csv("krn_metadata.csv", index=False)
 krn_metadata
 
 # %% [markdown]
 # ## Reading in filenames from DCMLab/bach_chorales
+#
+# The `.mscz` files in `data/DCMLab_cap/MS3` are conversions of the original `.mscx` files and have the same names.
 
 # %%
-print("Discovering files in ../DCMLab_cap/MS3")
-dcml_chorales = os.path.expanduser("../DCMLab_cap/MS3")
-cap_files = get_dcml_files(dcml_chorales, extension='.mscx', remove_extension=False)
-title_list = [fname_title[0] if fname_title else None for fname_title in cap_files.values()]
+print("Discovering files in ../data/DCMLab_cap/MS3")
+title_list = [os.path.splitext(os.path.basename(cap_files[i]))[0] + '.mscx' if i in cap_files else None for i in range(1, 372)]
 
 
 # %% [markdown]
@@ -128,6 +151,7 @@ riemenschneider = pd.concat([
 ], axis=1)
 riemenschneider.to_csv("riemenschneider.csv")
 print("Stored metadata to riemenschneider.csv")
+record_stage("prepare_metadata", INPUTS, OUTPUTS, keys=CAP_FILENAMES)
 riemenschneider
 
 # %%
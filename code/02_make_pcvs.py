@@ -25,7 +25,8 @@ import pandas as pd
 #pd.set_option('display.max_rows', 500)
 import ms3
 
-from utils import get_dcml_files
+from manifest import get_manifest
+from score_notes import load_score_notes
 
 cwd = os.path.abspath('')
 print(f"Changing the current working directory to {cwd}")
@@ -33,27 +34,44 @@ os.chdir(cwd)
 
 DATA_FOLDER = os.path.abspath("../data")
 assert os.path.isdir(DATA_FOLDER), f"Directory not found: {DATA_FOLDER}"
+MANIFEST = get_manifest(DATA_FOLDER)
+
+# If True, the notes are read directly from the first measures of the scores (see score_notes.py) rather than from the
+# complete notes tables extracted by ms3. Both yield the same pitch-class vectors.
+READ_SCORES = False
+N_MCS = 2 # number of measures for the pitch-class vectors, None for complete pieces
+# both settings can be overridden by environment variables, e.g. `N_MCS=0 python 02_make_pcvs.py` for complete pieces
+if "READ_SCORES" in os.environ:
+    READ_SCORES = os.environ["READ_SCORES"].lower() in ("1", "true", "yes")
+if "N_MCS" in os.environ:
+    N_MCS = int(os.environ["N_MCS"]) or None
+NOTES_ROLE = 'score' if READ_SCORES else 'notes'
+# one more measure than N_MCS because get_pcv() adds an anacrusis, if any
+MAX_MC = N_MCS + 1 if N_MCS else None
 
 # %% [markdown]
 # ## Loading notes
 
 # %%
-def load_notes_tables(number_filepath_tuples):
+def load_notes_tables(number_filepath_tuples, max_mc: Optional[int] = None):
+    """Loads notes TSV files with ms3 and score files with load_score_notes(), in which case only the first 'max_mc'
+    MCs are read."""
     result = {}
     for number, filepath in number_filepath_tuples:
         if filepath is None:
             result[number] = None
             continue
-        df = ms3.load_tsv(filepath)
+        if filepath.endswith('.tsv'):
+            df = ms3.load_tsv(filepath)
+        else:
+            df = load_score_notes(filepath, max_mc=max_mc)
         result[number] = df
     return result
 
 
 # %%
-dcml_notes_path = os.path.join(DATA_FOLDER, "DCMLab_cap", "notes")
-print(f"Loading notes tables from {dcml_notes_path}...")
-number_filepath_dict = {number: os.path.join(dcml_notes_path, basename_title[0]) for number, basename_title in get_dcml_files(dcml_notes_path, extension='.tsv', remove_extension=False).items() if basename_title}
-CAP = load_notes_tables(number_filepath_dict.items())
+print(f"Loading notes of the DCMLab_cap dataset from {NOTES_ROLE} files...")
+CAP = load_notes_tables(MANIFEST.get_files('cap', NOTES_ROLE).items(), max_mc=MAX_MC)
 
 
 # %% [markdown]
@@ -97,19 +115,16 @@ def get_concatenated_pcvs(notes_dict: Dict[str, pd.DataFrame],
     print(f"Stored pitch-class vectors as {file_path}")
     return result
 
-get_concatenated_pcvs(CAP, 'cap')
+get_concatenated_pcvs(CAP, 'cap', n_mcs=N_MCS)
 
 # %%
-krn_notes_path = os.path.join(DATA_FOLDER, "craigsapp_krn", "notes")
-print(f"Loading notes tables from {krn_notes_path}...")
-number_filepath_tuples = [(file[4:7], os.path.join(krn_notes_path, file)) for file in os.listdir(krn_notes_path) if file.endswith('.tsv')]
-KRN = load_notes_tables(number_filepath_tuples)
-get_concatenated_pcvs(KRN, 'krn')
+print(f"Loading notes of the craigsapp_krn dataset from {NOTES_ROLE} files...")
+# zero-padded keys, as used in the index of the stored krn.csv
+number_filepath_tuples = [(str(number).zfill(3), filepath) for number, filepath in MANIFEST.get_files('krn', NOTES_ROLE).items()]
+KRN = load_notes_tables(number_filepath_tuples, max_mc=MAX_MC)
+get_concatenated_pcvs(KRN, 'krn', n_mcs=N_MCS)
 
 # %%
-xml_notes_path = os.path.join(DATA_FOLDER, "MarkGotham_xml", "notes")
-print(f"Loading notes tables from {xml_notes_path}...")
-
-number_filepath_tuples = [(int(number), os.path.join(xml_notes_path, file)) for file in os.listdir(xml_notes_path) if file.endswith('.tsv') and (number := file[:3]).isdigit()]
-XML = load_notes_tables(number_filepath_tuples)
-get_concatenated_pcvs(XML, 'xml')
+print(f"Loading notes of the MarkGotham_xml dataset from {NOTES_ROLE} files...")
+XML = load_notes_tables(MANIFEST.get_files('xml', NOTES_ROLE).items(), max_mc=MAX_MC)
+get_concatenated_pcvs(XML, 'xml', n_mcs=N_MCS)
@@ -16,12 +16,17 @@
 # %%
 # %load_ext autoreload 
 # %autoreload 2
-import os
 from typing import Dict, Optional
 import pandas as pd
 from pymeasuremap.base import MeasureMap
 from pymeasuremap.compare import Compare
 
+import compact_measure_maps
+from compact_measure_maps import CompactMeasureMap
+from manifest import get_manifest
+
+COMPACT = True # load measure maps as CompactMeasureMap (see compact_measure_maps.py) rather than MeasureMap objects
+
 def are_measure_maps_identical(
         preferred_mms: Dict[int, MeasureMap],
         other_mms: Dict[int, MeasureMap],
@@ -42,10 +47,17 @@ def are_measure_maps_identical(
         if preferred is None or other is None:
             print(f"Skipped R. {R}")
             continue
-        comparison = Compare(preferred, other)
-        if comparison.all_identical(
-            ID=ID, count=count, qstamp=qstamp, number=number, name=name, time_signature=time_signature, nominal_length=nominal_length, 
-            actual_length=actual_length, start_repeat=start_repeat, end_repeat=end_repeat, next=next):
+        if isinstance(preferred, CompactMeasureMap):
+            identical = compact_measure_maps.all_identical(
+                preferred, other,
+                ID=ID, count=count, qstamp=qstamp, number=number, name=name, time_signature=time_signature, nominal_length=nominal_length, 
+                actual_length=actual_length, start_repeat=start_repeat, end_repeat=end_repeat, next=next)
+        else:
+            comparison = Compare(preferred, other)
+            identical = comparison.all_identical(
+                ID=ID, count=count, qstamp=qstamp, number=number, name=name, time_signature=time_signature, nominal_length=nominal_length, 
+                actual_length=actual_length, start_repeat=start_repeat, end_repeat=end_repeat, next=next)
+        if identical:
             print(f"R. {R} OK.")
         else:
             #diagnosis = comparison.diagnose()
@@ -53,30 +65,24 @@ def are_measure_maps_identical(
             print(f"Mismatch for R. {R}")
 
 
-def load_measure_maps(directory: str, filenames: pd.Series) -> Dict[int, MeasureMap]:
-    """Load measure maps by appending each filename from the series to the directory and loading the filepath.
-    The dictionary keys correspond to the index of the series.
+def load_measure_maps(filepaths: Dict[int, Optional[str]], compact: bool = COMPACT) -> Dict[int, MeasureMap]:
+    """Load the measure maps from the given filepaths (as returned by Manifest.get_aligned_files()). The dictionary
+    keys are kept, missing files yield None.
     """
+    load = CompactMeasureMap.from_json_file if compact else MeasureMap.from_json_file
     result = {}
-    for ix, filename in filenames.items():
+    for ix, filepath in filepaths.items():
+        if filepath is None:
+            print(f"No measure map for R. {ix}")
+            result[ix] = None
+            continue
         try:
-            filepath = os.path.join(directory, filename)
-            mm = MeasureMap.from_json_file(filepath)
+            mm = load(filepath)
             result[ix] = mm
         except Exception as e:
             print(f"{filepath} failed with\n\t{e!r}")
             result[ix] = None
     return result
-    
-
-def remove_extension(filename):
-    try:
-        return os.path.splitext(filename)[0]
-    except Exception:
-        return filename
-
-def remove_filename(rel_path: str):
-    return os.path.dirname(rel_path)
 
 
 # %%
@@ -84,18 +90,22 @@ alignment = pd.read_csv("../aligned_files.csv", index_col=0)
 alignment
 
 # %%
-krn_msc_mm_path = os.path.abspath("../data/craigsapp_krn/measuremaps/")
-krn_krn_mm_path = os.path.join(krn_msc_mm_path, "kern")
-krn_xml_mm_path = os.path.join(krn_msc_mm_path, "musicxml")
-krn_mm_filenames = alignment.krn_file.map(remove_extension) + '.mm.json'
+manifest = get_manifest("../data")
+
+def get_measure_map_paths(dataset: str, variant: str = "") -> Dict[int, Optional[str]]:
+    """{Riemenschneider -> path of the measure map of the aligned file}, resolved through the manifest, where the
+    variant is the subfolder of `measuremaps` (e.g. 'kern') or, for the MarkGotham_xml files grouped in one folder
+    per piece, the file stem (e.g. 'analysis' for 001/analysis.mm.json)."""
+    return manifest.get_aligned_files(dataset, "measuremap", alignment[f"{dataset}_file"].items(), variant)
+
 
 # %% [markdown]
 # ## Comparing MMs for `.krn` against those for their `.musicxml` and `.msc` conversions
 
 # %%
-krn_msc_mms = load_measure_maps(krn_msc_mm_path, krn_mm_filenames)
-krn_krn_mms = load_measure_maps(krn_krn_mm_path, krn_mm_filenames)
-krn_xml_mms = load_measure_maps(krn_xml_mm_path, krn_mm_filenames)
+krn_msc_mms = load_measure_maps(get_measure_map_paths("krn"))
+krn_krn_mms = load_measure_maps(get_measure_map_paths("krn", "kern"))
+krn_xml_mms = load_measure_maps(get_measure_map_paths("krn", "musicxml"))
 
 # %%
 are_measure_maps_identical(krn_krn_mms, krn_xml_mms, number=False, end_repeat=False, next=False)
@@ -104,21 +114,10 @@ are_measure_maps_identical(krn_krn_mms, krn_xml_mms, number=False, end_repeat=Fa
 # ## Comparing analysis MMs against all score MMs
 
 # %%
-xml_mm_path = os.path.abspath("../data/MarkGotham_xml/measuremaps/")
-xml_mxl_mm_filenames = alignment.xml_file.map(remove_extension) + ".mm.json"
-xml_folders = alignment.xml_file.map(remove_filename)
-xml_msc_mm_filenames = xml_folders + ".mm.json"
-analysis_paths = xml_folders.map(lambda folder: os.path.join(folder, "analysis.mm.json"))
-
-# %%
-cap_mm_path = os.path.abspath("../data/DCMLab_cap/measuremaps/")
-cap_mm_filenames = alignment.cap_file.map(remove_extension) + ".mm.json"
-
-# %%
-xml_mxl_mms = load_measure_maps(xml_mm_path, xml_mxl_mm_filenames)
-xml_msc_mms = load_measure_maps(xml_mm_path, xml_msc_mm_filenames)
-analysis_mms = load_measure_maps(xml_mm_path, analysis_paths)
-cap_mms = load_measure_maps(cap_mm_path, cap_mm_filenames)
+xml_mxl_mms = load_measure_maps(get_measure_map_paths("xml", "short_score"))
+xml_msc_mms = load_measure_maps(get_measure_map_paths("xml"))
+analysis_mms = load_measure_maps(get_measure_map_paths("xml", "analysis"))
+cap_mms = load_measure_maps(get_measure_map_paths("cap"))
 
 
 # %%
@@ -144,10 +143,16 @@ def quick_diagnosis(
         if preferred is None or other is None:
             print(f"Skipped R. {R}")
             continue
-        comparison = Compare(preferred, other)
-        result = comparison.quick_diagnosis(
-            ID=ID, count=count, qstamp=qstamp, number=number, name=name, time_signature=time_signature, nominal_length=nominal_length, 
-            actual_length=actual_length, start_repeat=start_repeat, end_repeat=end_repeat, next=next, entries_threshold=entries_threshold)
+        if isinstance(preferred, CompactMeasureMap):
+            result = compact_measure_maps.quick_diagnosis(
+                preferred, other,
+                ID=ID, count=count, qstamp=qstamp, number=number, name=name, time_signature=time_signature, nominal_length=nominal_length, 
+                actual_length=actual_length, start_repeat=start_repeat, end_repeat=end_repeat, next=next, entries_threshold=entries_threshold)
+        else:
+            comparison = Compare(preferred, other)
+            result = comparison.quick_diagnosis(
+                ID=ID, count=count, qstamp=qstamp, number=number, name=name, time_signature=time_signature, nominal_length=nominal_length, 
+                actual_length=actual_length, start_repeat=start_repeat, end_repeat=end_repeat, next=next, entries_threshold=entries_threshold)
         results[R] = result
     return pd.Series(results)
 
@@ -0,0 +1,244 @@
+"""This file checks the conversion stage (convert.py) without any of the external converters, by running it on a small
+fake repository in a temporary folder with stub_converter.py standing in for hum2xml, MuseScore, MM and ms3. The
+checks build on each other and cover:
+
+* done: all three stages run and create the expected targets;
+* skip: a second run skips every job without calling the converter, and only jobs with changed sources are re-run;
+* retry: a job failing on its first attempt succeeds on the second; without retries it fails and is not journaled;
+* timeout: a hanging converter is killed after the timeout, leaves no target behind, and a job's own timeout takes
+  precedence over the default one;
+* resume: after an interrupted run (including a truncated journal line), only the jobs missing from the journal run;
+* cli: `python convert.py` with the stub as every executable exits with code 0.
+
+Run from the `code` folder (it is also a stage of regression.py):
+
+    python check_convert.py [--keep]
+
+The exit code is 1 if any check failed.
+"""
+
+import argparse
+import contextlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import convert
+from convert import Job, load_journal, make_extract_jobs, make_mscz_jobs, make_musicxml_jobs, run_jobs
+
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_converter.py")
+SOURCES = {
+    os.path.join("craigsapp_krn", "kern", "chor001.krn"): "**kern\n4c\n*-\n",
+    os.path.join("craigsapp_krn", "kern", "chor002.krn"): "**kern\n4d\n*-\n",
+    os.path.join("DCMLab_cap", "MS3", "001 Aus meines Herzens Grunde.mscx"): "<museScore/>\n",
+    os.path.join(convert.MARKGOTHAM_FOLDER, "Chorales", "001", "short_score.mxl"): "mxl\n",
+    os.path.join(convert.MARKGOTHAM_FOLDER, "Source", "1-120.mxl"): "mxl\n",
+}
+MSCZ_TARGETS = [
+    os.path.join("data", "craigsapp_krn", "musicxml", "chor001.mscz"),
+    os.path.join("data", "craigsapp_krn", "musicxml", "chor002.mscz"),
+    os.path.join("data", "DCMLab_cap", "MS3", "001 Aus meines Herzens Grunde.mscz"),
+    os.path.join("data", convert.MARKGOTHAM_FOLDER, "Chorales", "001.mscz"),
+    os.path.join("data", convert.MARKGOTHAM_FOLDER, "Source", "1-120.mscz"),
+]
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def expect(condition: bool, description: str):
+    if not condition:
+        raise CheckFailed(description)
+
+
+@contextlib.contextmanager
+def environment(**variables: str):
+    """Temporarily sets environment variables, which are inherited by the converter subprocesses."""
+    previous = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+
+class FakeRepository:
+    """Submodule sources, journal and stub log in a temporary folder."""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.journal = os.path.join(folder, "data", ".conversion_journal.jsonl")
+        self.log = os.path.join(folder, "stub.log")
+        for path, contents in SOURCES.items():
+            self.write(path, contents)
+
+    def write(self, path: str, contents: str):
+        path = os.path.join(self.folder, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(contents)
+
+    def jobs(self, stage: str) -> List[Job]:
+        if stage == "musicxml":
+            return make_musicxml_jobs(self.folder, hum2xml=STUB)
+        if stage == "mscz":
+            return make_mscz_jobs(self.folder, musescore=STUB)
+        return make_extract_jobs(self.folder, ms3=STUB, mm=STUB)
+
+    def run(self, jobs: List[Job], **kwargs) -> Dict[str, str]:
+        kwargs = dict(dict(journal_path=self.journal, timeout=20.0, retries=0), **kwargs)
+        return run_jobs(jobs, **kwargs)
+
+    def calls(self) -> List[List[str]]:
+        """Returns and clears the (process ID, arguments) of the stub's calls since the last time."""
+        if not os.path.isfile(self.log):
+            return []
+        with open(self.log, "r", encoding="utf-8") as f:
+            calls = [line.rstrip("\n").split("\t", 1) for line in f]
+        os.remove(self.log)
+        return calls
+
+
+def check_done(repo: FakeRepository):
+    for stage in convert.STAGES:
+        statuses = repo.run(repo.jobs(stage))
+        expect(set(statuses.values()) == {"done"}, f"stage {stage!r}: {statuses}")
+    for target in MSCZ_TARGETS:
+        expect(os.path.isfile(os.path.join(repo.folder, target)), f"{target} missing")
+    with open(os.path.join(repo.folder, "craigsapp_krn", "musicxml", "chor001.xml"), encoding="utf-8") as f:
+        expect(f.read() == SOURCES[os.path.join("craigsapp_krn", "kern", "chor001.krn")],
+               "hum2xml output not written to the target")
+    for folder in ("measures", "measuremaps", "notes"):
+        path = os.path.join(repo.folder, "data", "DCMLab_cap", folder)
+        expect(os.path.isdir(path), f"{path} missing")
+
+
+def check_skip(repo: FakeRepository):
+    repo.calls()
+    for stage in convert.STAGES:
+        statuses = repo.run(repo.jobs(stage))
+        expect(set(statuses.values()) == {"skipped"}, f"stage {stage!r}: {statuses}")
+    expect(not repo.calls(), "the converter was called for up-to-date jobs")
+    repo.write(os.path.join("craigsapp_krn", "kern", "chor001.krn"), "**kern\n2c\n*-\n")
+    statuses = repo.run(repo.jobs("musicxml"))
+    expect(sorted(statuses.values()) == ["done", "skipped"], f"after changing one source: {statuses}")
+
+
+def check_retry(repo: FakeRepository):
+    jobs = repo.jobs("mscz")
+    repo.calls()
+    with environment(STUB_FAIL_ONCE=os.path.join(repo.folder, "fail_once_1")):
+        statuses = repo.run(jobs, retries=1, force=True)
+    expect(set(statuses.values()) == {"done"}, f"with one retry: {statuses}")
+    expect(len(repo.calls()) == 2 * len(jobs), "expected two attempts per job")
+    journal = load_journal(repo.journal)
+    with open(repo.journal, encoding="utf-8") as f:
+        n_lines = len(f.readlines())
+    with environment(STUB_FAIL_ONCE=os.path.join(repo.folder, "fail_once_2")):
+        statuses = repo.run(jobs, retries=0, force=True)
+    expect(set(statuses.values()) == {"failed"}, f"without retries: {statuses}")
+    with open(repo.journal, encoding="utf-8") as f:
+        expect(len(f.readlines()) == n_lines, "failed jobs were journaled")
+    expect(load_journal(repo.journal) == journal, "the journal changed")
+
+
+def check_timeout(repo: FakeRepository):
+    job = repo.jobs("musicxml")[0]
+    target = os.path.join(repo.folder, "craigsapp_krn", "musicxml", "chor001.xml")
+    with open(target, encoding="utf-8") as f:
+        before = f.read()
+    repo.calls()
+    start = time.perf_counter()
+    with environment(STUB_SLEEP="30"):
+        statuses = repo.run([job], timeout=0.5, force=True)
+    seconds = time.perf_counter() - start
+    expect(statuses[job.name] == "failed", f"hanging job: {statuses}")
+    expect(seconds < 10, f"the hanging job was not killed after the timeout but took {seconds:.1f} s")
+    for pid, _ in repo.calls():
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            continue
+        raise CheckFailed(f"the converter process {pid} is still running")
+    with open(target, encoding="utf-8") as f:
+        expect(f.read() == before, "the timed-out job changed its target")
+    expect(not os.path.exists(target + ".tmp"), "the timed-out job left a temporary file")
+    with environment(STUB_SLEEP="1"):
+        statuses = repo.run([job._replace(timeout=20.0)], timeout=0.5, force=True)
+    expect(statuses[job.name] == "done", f"the job's own timeout was not used: {statuses}")
+
+
+def check_resume(repo: FakeRepository):
+    repo.journal = os.path.join(repo.folder, "resumed_journal.jsonl")
+    jobs = repo.jobs("mscz")
+    repo.run(jobs[:2])
+    with open(repo.journal, "a", encoding="utf-8") as f:
+        f.write('{"name": "mscz:da')
+    repo.calls()
+    statuses = repo.run(jobs)
+    expected = {job.name: "skipped" if i < 2 else "done" for i, job in enumerate(jobs)}
+    expect(statuses == expected, f"after the interruption: {statuses}")
+    expect(len(repo.calls()) == len(jobs) - 2, "completed jobs were run again")
+
+
+def check_cli(repo: FakeRepository):
+    command = [sys.executable, os.path.join(os.path.dirname(STUB), "convert.py"), "--repo", repo.folder,
+               "--journal", os.path.join(repo.folder, "cli_journal.jsonl"), "--retries", "0"]
+    for option in ("--hum2xml", "--musescore", "--ms3", "--mm"):
+        command += [option, STUB]
+    process = subprocess.run(command, capture_output=True, text=True, timeout=120)
+    expect(process.returncode == 0, f"exit code {process.returncode}:\n{process.stdout}{process.stderr}")
+
+
+CHECKS: Dict[str, Callable[[FakeRepository], None]] = dict(
+    done=check_done,
+    skip=check_skip,
+    retry=check_retry,
+    timeout=check_timeout,
+    resume=check_resume,
+    cli=check_cli,
+)
+
+
+def main(args: argparse.Namespace) -> int:
+    folder = tempfile.mkdtemp(prefix="check_convert_")
+    repo = FakeRepository(folder)
+    failed = False
+    try:
+        with environment(STUB_LOG=repo.log):
+            for name, check in CHECKS.items():
+                try:
+                    check(repo)
+                except CheckFailed as e:
+                    print(f"{name}: FAILED ({e})")
+                    failed = True
+                except Exception as e:
+                    print(f"{name}: FAILED with {e!r}")
+                    failed = True
+                else:
+                    print(f"{name}: OK")
+    finally:
+        if args.keep:
+            print(f"Kept the fake repository in {folder}")
+        else:
+            shutil.rmtree(folder, ignore_errors=True)
+    return 1 if failed else 0
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Checks convert.py with a stub converter.")
+    parser.add_argument("--keep", action="store_true", help="Do not delete the fake repository.")
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(main(get_arg_parser().parse_args()))
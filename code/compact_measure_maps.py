@@ -0,0 +1,306 @@
+"""This file contains a compact in-memory representation of measure maps for comparing many of them at once, as done in
+04_compare_measure_maps.py. Instead of one Measure object per entry, a CompactMeasureMap stores one array per field
+(struct of arrays):
+
+* numeric fields are stored in typed arrays, with a sentinel for missing values (NaN for floats);
+* time signatures are interned as small integers shared by all maps (see TIME_SIGNATURES);
+* the `next` lists are stored in CSR form, i.e. all values concatenated plus the offsets where each entry's list starts;
+* ID and name are stored only if they differ from the defaults str(count) and str(number), respectively.
+
+CompactMeasureMap.to_measure_map() restores the original MeasureMap, and quick_diagnosis() and all_identical() mirror
+the methods of pymeasuremap.compare.Compare without creating any Measure objects.
+"""
+
+import json
+import math
+import time
+import tracemalloc
+from array import array
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import pandas as pd
+from pymeasuremap.base import Measure, MeasureMap
+
+from manifest import DATASETS, get_manifest
+
+FIELDS = ('ID', 'count', 'qstamp', 'number', 'name', 'time_signature', 'nominal_length', 'actual_length',
+          'start_repeat', 'end_repeat', 'next')
+INT_NONE = -2 ** 31
+BOOL_NONE = -1
+
+
+class TimeSignatureTable:
+    """Interns time signature strings as small integers. None is encoded as -1."""
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self.codes: Dict[str, int] = {}
+
+    def encode(self, time_signature: Optional[str]) -> int:
+        if time_signature is None:
+            return -1
+        code = self.codes.get(time_signature)
+        if code is None:
+            code = len(self.strings)
+            self.strings.append(time_signature)
+            self.codes[time_signature] = code
+        return code
+
+    def decode(self, code: int) -> Optional[str]:
+        return None if code < 0 else self.strings[code]
+
+
+TIME_SIGNATURES = TimeSignatureTable()
+
+
+def encode_int(value: Optional[int]) -> int:
+    return INT_NONE if value is None else value
+
+
+def decode_int(value: int) -> Optional[int]:
+    return None if value == INT_NONE else value
+
+
+def encode_float(value: Optional[float]) -> float:
+    return math.nan if value is None else value
+
+
+def decode_float(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+
+def encode_bool(value: Optional[bool]) -> int:
+    return BOOL_NONE if value is None else int(value)
+
+
+def decode_bool(value: int) -> Optional[bool]:
+    return None if value == BOOL_NONE else bool(value)
+
+
+def compress_strings(values: List[Optional[str]], defaults: Sequence[Optional[int]]) -> Optional[List[Optional[str]]]:
+    """Returns None if all values are missing, 'default' if they all equal str(default), otherwise the list itself."""
+    if all(value is None for value in values):
+        return None
+    if all(value == str(default) for value, default in zip(values, defaults)):
+        return 'default'
+    return values
+
+
+class CompactMeasureMap:
+    """Struct-of-arrays representation of a MeasureMap."""
+
+    __slots__ = ('IDs', 'counts', 'qstamps', 'numbers', 'names', 'time_signatures', 'nominal_lengths', 'actual_lengths',
+                 'start_repeats', 'end_repeats', 'next_offsets', 'next_values', 'has_next')
+
+    def __init__(self, dicts: Sequence[dict]):
+        """Takes the entries of a measure map in the form of dictionaries, as stored in .mm.json files."""
+        get = [[d.get(field) for d in dicts] for field in FIELDS]
+        IDs, counts, qstamps, numbers, names, time_signatures, nominal_lengths, actual_lengths, start_repeats, \
+            end_repeats, nexts = get
+        self.counts = array('i', map(encode_int, counts))
+        self.qstamps = array('d', map(encode_float, qstamps))
+        self.numbers = array('i', map(encode_int, numbers))
+        self.time_signatures = array('h', map(TIME_SIGNATURES.encode, time_signatures))
+        self.nominal_lengths = array('d', map(encode_float, nominal_lengths))
+        self.actual_lengths = array('d', map(encode_float, actual_lengths))
+        self.start_repeats = array('b', map(encode_bool, start_repeats))
+        self.end_repeats = array('b', map(encode_bool, end_repeats))
+        self.IDs = compress_strings([None if ID is None else str(ID) for ID in IDs], counts)
+        self.names = compress_strings([None if name is None else str(name) for name in names], numbers)
+        self.has_next = array('b', (next_list is not None for next_list in nexts))
+        self.next_offsets = array('i', [0])
+        self.next_values = array('i')
+        for next_list in nexts:
+            if next_list:
+                if not all(isinstance(value, int) for value in next_list):
+                    raise ValueError(f"Only measure counts (int) are supported as 'next' values, got {next_list!r}")
+                self.next_values.extend(next_list)
+            self.next_offsets.append(len(self.next_values))
+
+    @classmethod
+    def from_json_file(cls, filepath: str) -> 'CompactMeasureMap':
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def from_measure_map(cls, measure_map: MeasureMap) -> 'CompactMeasureMap':
+        return cls([entry.as_dict() for entry in measure_map])
+
+    def __len__(self) -> int:
+        """Like MeasureMap.__len__(), the highest count value."""
+        return max(count for count in self.counts if count != INT_NONE)
+
+    @property
+    def n_entries(self) -> int:
+        return len(self.counts)
+
+    def get_next(self, i: int) -> Optional[List[int]]:
+        """Returns the 'next' list of the i-th entry (0-based)."""
+        if not self.has_next[i]:
+            return None
+        return self.next_values[self.next_offsets[i]:self.next_offsets[i + 1]].tolist()
+
+    def get_strings(self, field: str) -> List[Optional[str]]:
+        """Returns the IDs or names of all entries."""
+        stored, defaults = (self.IDs, self.counts) if field == 'ID' else (self.names, self.numbers)
+        if stored is None:
+            return [None] * self.n_entries
+        if stored == 'default':
+            return [None if default == INT_NONE else str(default) for default in defaults]
+        return stored
+
+    def iter_dicts(self) -> Iterator[dict]:
+        """Yields one dictionary per entry, omitting fields that are not specified (like Measure.as_dict())."""
+        IDs, names = self.get_strings('ID'), self.get_strings('name')
+        for i in range(self.n_entries):
+            values = (
+                IDs[i],
+                decode_int(self.counts[i]),
+                decode_float(self.qstamps[i]),
+                decode_int(self.numbers[i]),
+                names[i],
+                TIME_SIGNATURES.decode(self.time_signatures[i]),
+                decode_float(self.nominal_lengths[i]),
+                decode_float(self.actual_lengths[i]),
+                decode_bool(self.start_repeats[i]),
+                decode_bool(self.end_repeats[i]),
+                self.get_next(i),
+            )
+            yield {field: value for field, value in zip(FIELDS, values) if value is not None}
+
+    def to_measure_map(self) -> MeasureMap:
+        return MeasureMap([Measure(**d) for d in self.iter_dicts()])
+
+    def get_field(self, field: str) -> list:
+        """Returns the encoded values of the field as a list, suitable for comparing two compact measure maps."""
+        if field == 'ID' or field == 'name':
+            return self.get_strings(field)
+        if field == 'next':
+            return [self.get_next(i) for i in range(self.n_entries)]
+        encoded = getattr(self, field + 's')
+        if encoded.typecode == 'd':
+            # NaN != NaN, so missing values are compared as None
+            return [None if math.isnan(value) else value for value in encoded]
+        return encoded.tolist()
+
+    def nbytes(self) -> int:
+        """Approximate memory footprint of the arrays, without the shared time signature table."""
+        arrays = (self.counts, self.qstamps, self.numbers, self.time_signatures, self.nominal_lengths,
+                  self.actual_lengths, self.start_repeats, self.end_repeats, self.next_offsets, self.next_values,
+                  self.has_next)
+        size = sum(a.itemsize * len(a) for a in arrays)
+        for strings in (self.IDs, self.names):
+            if isinstance(strings, list):
+                size += sum(len(s) for s in strings if s is not None)
+        return size
+
+    def __repr__(self):
+        return f"CompactMeasureMap({self.n_entries} entries)"
+
+
+def first_difference(preferred: CompactMeasureMap,
+                     other: CompactMeasureMap,
+                     fields: Sequence[str]) -> Optional[str]:
+    """Returns the name of the first field that differs in the first entry that differs (in the order of entries and
+    then of `fields`), or None if all compared entries are identical. Like Compare, compares only as many entries as
+    the shorter map has."""
+    n = min(preferred.n_entries, other.n_entries)
+    first_index, first_field = n, None
+    for field in fields:
+        preferred_values = preferred.get_field(field)
+        other_values = other.get_field(field)
+        for i in range(first_index):
+            if preferred_values[i] != other_values[i]:
+                # the fields are visited in order, so only a strictly earlier entry replaces the current result
+                first_index, first_field = i, field
+                break
+    return first_field
+
+
+def get_compared_fields(**mask: bool) -> List[str]:
+    return [field for field in FIELDS if mask[field]]
+
+
+def all_identical(preferred: CompactMeasureMap,
+                  other: CompactMeasureMap,
+                  ID: bool = False,
+                  count: bool = True,
+                  qstamp: bool = True,
+                  number: bool = True,
+                  name: bool = False,
+                  time_signature: bool = True,
+                  nominal_length: bool = True,
+                  actual_length: bool = True,
+                  start_repeat: bool = True,
+                  end_repeat: bool = True,
+                  next: bool = True,
+                  ) -> bool:
+    """Same as pymeasuremap.compare.Compare.all_identical()."""
+    if len(preferred) != len(other):
+        return False
+    fields = get_compared_fields(ID=ID, count=count, qstamp=qstamp, number=number, name=name,
+                                 time_signature=time_signature, nominal_length=nominal_length,
+                                 actual_length=actual_length, start_repeat=start_repeat, end_repeat=end_repeat,
+                                 next=next)
+    return first_difference(preferred, other, fields) is None
+
+
+def quick_diagnosis(preferred: CompactMeasureMap,
+                    other: CompactMeasureMap,
+                    ID: bool = False,
+                    count: bool = True,
+                    qstamp: bool = True,
+                    number: bool = True,
+                    name: bool = False,
+                    time_signature: bool = True,
+                    nominal_length: bool = True,
+                    actual_length: bool = True,
+                    start_repeat: bool = True,
+                    end_repeat: bool = True,
+                    next: bool = True,
+                    entries_threshold: Optional[int] = None,
+                    ) -> str:
+    """Same as pymeasuremap.compare.Compare.quick_diagnosis(): 'OK' for a perfect match, otherwise the name of the
+    first diverging field or, if the maps differ in length, a label indicating the difference."""
+    if len(preferred) != len(other):
+        if entries_threshold is None:
+            return "entries"
+        n_diff = abs(len(preferred) - len(other))
+        if n_diff > entries_threshold:
+            return f">{entries_threshold}_entries"
+        return f"≤{entries_threshold}_entries"
+    fields = get_compared_fields(ID=ID, count=count, qstamp=qstamp, number=number, name=name,
+                                 time_signature=time_signature, nominal_length=nominal_length,
+                                 actual_length=actual_length, start_repeat=start_repeat, end_repeat=end_repeat,
+                                 next=next)
+    field = first_difference(preferred, other, fields)
+    return "OK" if field is None else field
+
+
+def benchmark(filepaths: Sequence[str]) -> pd.DataFrame:
+    """Loads the given measure maps once as MeasureMap and once as CompactMeasureMap objects and reports the time
+    and the memory allocated by each (measured with tracemalloc, which slows down both in the same way).
+    """
+    results = {}
+    for name, load in (('MeasureMap', MeasureMap.from_json_file),
+                       ('CompactMeasureMap', CompactMeasureMap.from_json_file)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        loaded = [load(filepath) for filepath in filepaths]
+        seconds = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = dict(n_maps=len(loaded), seconds=seconds, retained_MB=current / 2 ** 20,
+                             peak_MB=peak / 2 ** 20)
+        del loaded
+    return pd.DataFrame(results).T
+
+
+if __name__ == "__main__":
+    manifest = get_manifest()
+    mm_paths = [path
+                for dataset in DATASETS
+                for variant in sorted(manifest.iter_variants(dataset, "measuremap"))
+                for path in manifest.get_files(dataset, "measuremap", variant).values()]
+    print(f"Loading {len(mm_paths)} measure maps from {manifest.data_folder}")
+    print(benchmark(mm_paths).to_string())
@@ -0,0 +1,279 @@
+"""This file re-generates the `data` folder from the submodules, replacing the serial steps of extract_data.sh:
+
+1. `hum2xml`: **kern => musicxml for the craigsapp_krn dataset (what `make musicxml` does in the submodule)
+2. MuseScore 4: all scores => `.mscz` (the MarkGotham_xml files `###/short_score.mxl` directly become `###.mscz`;
+   the collections in `Source` are converted, too, like by `ms3 convert` in extract_data.sh)
+3. `MM extract` and `ms3 extract`: measure maps, measures and notes, one job per dataset.
+
+The external commands run in an asyncio subprocess pool with bounded concurrency, per-job timeouts and retries
+(the dataset-wide extraction jobs have a longer timeout of their own).
+Every successful job is appended to a journal together with the hash of its source files so that an interrupted
+run can be resumed and jobs whose sources have not changed are skipped. The executables can be replaced, e.g. by
+stub_converter.py for testing without a MuseScore installation:
+
+    python convert.py --musescore ./stub_converter.py --stages mscz
+
+check_convert.py uses the stub to check the stage on a fake repository.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from utils import hash_sources
+
+REPO_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+JOURNAL_PATH = os.path.join(REPO_FOLDER, "data", ".conversion_journal.jsonl")
+STAGES = ("musicxml", "mscz", "extract")
+MARKGOTHAM_FOLDER = os.path.join("MarkGotham_xml", "Bach,_Johann_Sebastian")
+EXTRACT_TIMEOUT = 3600.0
+
+
+class Job(NamedTuple):
+    name: str
+    """Unique key under which the job is stored in the journal."""
+    command: Tuple[str, ...]
+    sources: Tuple[str, ...]
+    targets: Tuple[str, ...]
+    stdout_path: Optional[str] = None
+    """If set, the command's standard output is written to this file (for converters that don't take an output
+    path)."""
+    timeout: Optional[float] = None
+    """Timeout in seconds per attempt, overriding the one passed to run_jobs()."""
+
+
+def list_files(directory: str, extensions: Tuple[str, ...]) -> List[str]:
+    """Recursively lists the files with the given extensions, sorted."""
+    result = []
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                    elif entry.name.endswith(extensions):
+                        result.append(entry.path)
+        except FileNotFoundError:
+            print(f"Directory not found: {current}")
+    return sorted(result)
+
+
+def make_musicxml_jobs(repo_folder: str = REPO_FOLDER, hum2xml: str = "hum2xml") -> List[Job]:
+    kern_folder = os.path.join(repo_folder, "craigsapp_krn", "kern")
+    musicxml_folder = os.path.join(repo_folder, "craigsapp_krn", "musicxml")
+    jobs = []
+    for source in list_files(kern_folder, (".krn",)):
+        fname = os.path.splitext(os.path.basename(source))[0] + ".xml"
+        target = os.path.join(musicxml_folder, fname)
+        jobs.append(Job(f"musicxml:{os.path.relpath(target, repo_folder)}", (hum2xml, source), (source,), (target,),
+                        stdout_path=target))
+    return jobs
+
+
+def mscz_target(source: str, repo_folder: str = REPO_FOLDER) -> str:
+    """Maps a score from one of the submodules to the corresponding .mscz path in the data folder. The
+    MarkGotham_xml files '###/short_score.mxl' are renamed to '###.mscz'."""
+    rel_path = os.path.relpath(source, repo_folder)
+    directory, fname = os.path.split(rel_path)
+    if fname.startswith("short_score."):
+        directory, fname = os.path.split(directory)
+    fname = os.path.splitext(fname)[0] + ".mscz"
+    return os.path.join(repo_folder, "data", directory, fname)
+
+
+def make_mscz_jobs(repo_folder: str = REPO_FOLDER, musescore: str = "mscore") -> List[Job]:
+    sources = list_files(os.path.join(repo_folder, "DCMLab_cap", "MS3"), (".mscx",)) + \
+        list_files(os.path.join(repo_folder, "craigsapp_krn", "musicxml"), (".xml",)) + \
+        list_files(os.path.join(repo_folder, MARKGOTHAM_FOLDER, "Chorales"), (".mxl",)) + \
+        list_files(os.path.join(repo_folder, MARKGOTHAM_FOLDER, "Source"), (".mxl", ".xml"))
+    jobs = []
+    for source in sources:
+        target = mscz_target(source, repo_folder)
+        jobs.append(Job(f"mscz:{os.path.relpath(target, repo_folder)}", (musescore, "-o", target, source),
+                        (source,), (target,)))
+    return jobs
+
+
+def make_extract_jobs(repo_folder: str = REPO_FOLDER,
+                      ms3: str = "ms3",
+                      mm: str = "MM",
+                      timeout: float = EXTRACT_TIMEOUT) -> List[Job]:
+    """One job per dataset and tool because ms3 and MM process entire folders, which is why they get a timeout of
+    their own."""
+    data_folder = os.path.join(repo_folder, "data")
+    jobs = []
+    for source_dir, target_dir in (
+            ("craigsapp_krn/kern", "craigsapp_krn/measuremaps/kern"),
+            ("craigsapp_krn/musicxml", "craigsapp_krn/measuremaps/musicxml"),
+            (os.path.join(MARKGOTHAM_FOLDER, "Chorales"), "MarkGotham_xml/measuremaps"),
+    ):
+        source_dir = os.path.join(repo_folder, source_dir)
+        target_dir = os.path.join(data_folder, target_dir)
+        sources = tuple(list_files(source_dir, (".krn", ".xml", ".mxl", ".txt")))
+        jobs.append(Job(f"MM:{os.path.relpath(target_dir, repo_folder)}",
+                        (mm, "extract", "-d", source_dir, "-o", target_dir), sources, (target_dir,), timeout=timeout))
+    for dataset in ("DCMLab_cap", "craigsapp_krn", "MarkGotham_xml"):
+        dataset_dir = os.path.join(data_folder, dataset)
+        sources = tuple(list_files(dataset_dir, (".mscz",)))
+        targets = tuple(os.path.join(dataset_dir, folder) for folder in ("measures", "measuremaps", "notes"))
+        jobs.append(Job(f"ms3:{os.path.relpath(dataset_dir, repo_folder)}",
+                        (ms3, "extract", "-a", "-d", dataset_dir, "-M", "measures", "-MM", "measuremaps", "-N", "notes",
+                         "-D"), sources, targets, timeout=timeout))
+    return jobs
+
+
+def load_journal(journal_path: str) -> Dict[str, str]:
+    """Returns {job name -> source hash} for all jobs that have completed. Later lines override earlier ones and
+    incomplete lines (from an interrupted write) are ignored."""
+    journal = {}
+    try:
+        with open(journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                journal[record["name"]] = record["hash"]
+    except FileNotFoundError:
+        pass
+    return journal
+
+
+def append_to_journal(journal_path: str, name: str, source_hash: str):
+    with open(journal_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(dict(name=name, hash=source_hash)) + "\n")
+
+
+def is_up_to_date(job: Job, source_hash: str, journal: Dict[str, str]) -> bool:
+    return journal.get(job.name) == source_hash and all(os.path.exists(target) for target in job.targets)
+
+
+async def run_command(job: Job, timeout: float) -> Tuple[int, str]:
+    """Runs the job's command once and returns (returncode, stderr). Output redirected to a file is written to a
+    temporary file first so that a failed or timed-out run never leaves a truncated target behind."""
+    for target in job.targets:
+        # targets without extension are folders
+        os.makedirs(os.path.dirname(target) if os.path.splitext(target)[1] else target, exist_ok=True)
+    process = await asyncio.create_subprocess_exec(
+        *job.command,
+        stdout=asyncio.subprocess.PIPE if job.stdout_path else asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return -1, f"timed out after {timeout} s"
+    if process.returncode == 0 and job.stdout_path:
+        tmp_path = job.stdout_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(stdout)
+        os.replace(tmp_path, job.stdout_path)
+    return process.returncode, stderr.decode(errors="replace").strip()
+
+
+async def run_job(job: Job,
+                  semaphore: asyncio.Semaphore,
+                  journal: Dict[str, str],
+                  journal_path: str,
+                  timeout: float,
+                  retries: int,
+                  force: bool) -> str:
+    """Returns 'skipped', 'done' or 'failed'."""
+    source_hash = hash_sources(job.sources)
+    if not force and is_up_to_date(job, source_hash, journal):
+        return "skipped"
+    async with semaphore:
+        for attempt in range(1, retries + 2):
+            try:
+                returncode, stderr = await run_command(job, timeout if job.timeout is None else job.timeout)
+            except OSError as e:
+                returncode, stderr = -1, repr(e)
+            if returncode == 0:
+                append_to_journal(journal_path, job.name, source_hash)
+                journal[job.name] = source_hash
+                return "done"
+            print(f"{job.name} failed (attempt {attempt}/{retries + 1}, exit code {returncode}): {stderr}")
+    return "failed"
+
+
+async def run_jobs_async(jobs: List[Job],
+                         journal_path: str = JOURNAL_PATH,
+                         max_concurrency: Optional[int] = None,
+                         timeout: float = 300.0,
+                         retries: int = 2,
+                         force: bool = False) -> Dict[str, str]:
+    if max_concurrency is None:
+        max_concurrency = os.cpu_count() or 1
+    os.makedirs(os.path.dirname(os.path.abspath(journal_path)), exist_ok=True)
+    journal = load_journal(journal_path)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    statuses = await asyncio.gather(*(run_job(job, semaphore, journal, journal_path, timeout, retries, force)
+                                      for job in jobs))
+    return {job.name: status for job, status in zip(jobs, statuses)}
+
+
+def run_jobs(jobs: List[Job], **kwargs) -> Dict[str, str]:
+    """Runs the jobs concurrently and returns {job name -> 'skipped'|'done'|'failed'}. See run_jobs_async() for the
+    keyword arguments."""
+    return asyncio.run(run_jobs_async(jobs, **kwargs))
+
+
+def summarize(statuses: Dict[str, str]) -> str:
+    counts = {}
+    for status in statuses.values():
+        counts[status] = counts.get(status, 0) + 1
+    return ", ".join(f"{n} {status}" for status, n in sorted(counts.items()))
+
+
+def main(args: argparse.Namespace):
+    job_makers = dict(
+        musicxml=lambda: make_musicxml_jobs(args.repo, hum2xml=args.hum2xml),
+        mscz=lambda: make_mscz_jobs(args.repo, musescore=args.musescore),
+        extract=lambda: make_extract_jobs(args.repo, ms3=args.ms3, mm=args.mm, timeout=args.extract_timeout),
+    )
+    any_failed = False
+    for stage in args.stages:
+        # jobs are created only when the stage starts because they depend on the previous stage's outputs
+        jobs = job_makers[stage]()
+        print(f"Stage {stage!r}: {len(jobs)} jobs")
+        statuses = run_jobs(jobs,
+                            journal_path=args.journal,
+                            max_concurrency=args.jobs,
+                            timeout=args.timeout,
+                            retries=args.retries,
+                            force=args.force)
+        print(f"Stage {stage!r}: {summarize(statuses)}")
+        any_failed |= "failed" in statuses.values()
+    return 1 if any_failed else 0
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Re-generates the data folder from the submodules.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES),
+                        help="Which stages to run, in the given order. Defaults to all.")
+    parser.add_argument("--repo", default=REPO_FOLDER, help="Top-level folder of the repository.")
+    parser.add_argument("--journal", default=JOURNAL_PATH, help="Path of the journal of completed jobs.")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Maximum number of concurrent subprocesses. Defaults to the number of CPUs.")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Timeout in seconds per attempt.")
+    parser.add_argument("--extract_timeout", type=float, default=EXTRACT_TIMEOUT,
+                        help=f"Timeout in seconds per attempt of the dataset-wide extraction jobs. Defaults to "
+                             f"{EXTRACT_TIMEOUT:.0f}.")
+    parser.add_argument("--retries", type=int, default=2, help="How often a failed job is retried.")
+    parser.add_argument("--force", action="store_true", help="Re-run jobs even if they are up to date.")
+    parser.add_argument("--hum2xml", default="hum2xml", help="hum2xml executable.")
+    parser.add_argument("--musescore", default=os.environ.get("MSCORE", "mscore"),
+                        help="MuseScore 4 executable. Defaults to the MSCORE environment variable or 'mscore'.")
+    parser.add_argument("--ms3", default="ms3", help="ms3 executable.")
+    parser.add_argument("--mm", default="MM", help="pyMeasureMap's MM executable.")
+    return parser
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(get_arg_parser().parse_args()))
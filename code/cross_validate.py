@@ -0,0 +1,200 @@
+"""This file checks the files extracted from each score for consistency with each other:
+
+* `measures/*.tsv` vs. `measuremaps/*.mm.json`: same number of measures and, per measure, `act_dur` vs.
+  `actual_length`, `timesig` vs. `time_signature`, `repeats` vs. `start_repeat`/`end_repeat`, and `next`;
+* `notes/*.tsv` vs. `measures/*.tsv`: every note (`mc_onset` + `duration_qb`) lies within the actual length of its
+  measure.
+
+The pieces are processed in batches, in parallel. Each batch is concatenated into one table per file type so that
+all checks run vectorized over the whole batch. Run as a script to print the report:
+
+    python cross_validate.py [-o issues.tsv]
+"""
+
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+from manifest import DATASETS, get_manifest
+
+CHECKS = ('n_measures', 'act_dur', 'timesig', 'start_repeat', 'end_repeat', 'next', 'note_onset', 'note_offset',
+          'note_mc')
+ISSUE_COLUMNS = ['dataset', 'number', 'mc', 'check', 'expected', 'found']
+TOLERANCE = 1e-6
+
+# (dataset, number, measures path, measure map path, notes path)
+Piece = Tuple[str, int, str, Optional[str], Optional[str]]
+
+
+def fraction_column(S: pd.Series) -> pd.Series:
+    """Converts a column of strings such as '3/4' or '1' into floats."""
+    if S.empty:
+        return pd.Series(index=S.index, dtype=float)
+    split = S.astype('string').str.split('/', n=1, expand=True)
+    numerator = pd.to_numeric(split[0])
+    if split.shape[1] == 1:
+        return numerator.astype(float)
+    denominator = pd.to_numeric(split[1]).fillna(1)
+    return numerator / denominator
+
+
+def normalize_next(S: pd.Series) -> pd.Series:
+    """Normalizes the string representation of 'next' columns such as '1, 3' or '1,3'."""
+    return S.fillna('').astype(str).str.replace(' ', '', regex=False)
+
+
+def load_batch(pieces: List[Piece]) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Concatenates the measures, measure maps and notes of the pieces into one table each, with the columns
+    `dataset` and `number` identifying the piece."""
+    measures, measure_maps, notes = [], [], []
+    for dataset, number, measures_path, mm_path, notes_path in pieces:
+        key = dict(dataset=dataset, number=number)
+        df = pd.read_csv(measures_path, sep='\t', usecols=['mc', 'timesig', 'act_dur', 'repeats', 'next'],
+                         dtype=str)
+        measures.append(df.assign(**key))
+        if mm_path is not None:
+            with open(mm_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            mm = pd.DataFrame.from_records([
+                (e.get('count'), e.get('time_signature'), e.get('actual_length'), e.get('start_repeat'),
+                 e.get('end_repeat'), ','.join(str(n) for n in e.get('next') or []))
+                for e in entries
+            ], columns=['mc', 'time_signature', 'actual_length', 'start_repeat', 'end_repeat', 'next'])
+            measure_maps.append(mm.assign(**key))
+        if notes_path is not None:
+            df = pd.read_csv(notes_path, sep='\t', usecols=['mc', 'mc_onset', 'duration_qb'], dtype=str)
+            notes.append(df.assign(**key))
+    measures = pd.concat(measures, ignore_index=True)
+    measures['mc'] = measures.mc.astype(int)
+    measures['act_dur'] = fraction_column(measures.act_dur) * 4
+    measure_maps = pd.concat(measure_maps, ignore_index=True) if measure_maps else pd.DataFrame(
+        columns=['mc', 'time_signature', 'actual_length', 'start_repeat', 'end_repeat', 'next', 'dataset', 'number'])
+    notes = pd.concat(notes, ignore_index=True) if notes else pd.DataFrame(
+        columns=['mc', 'mc_onset', 'duration_qb', 'dataset', 'number'])
+    notes['mc'] = notes.mc.astype(int)
+    notes['onset'] = fraction_column(notes.mc_onset) * 4
+    notes['duration_qb'] = notes.duration_qb.astype(float)
+    return measures, measure_maps, notes
+
+
+def make_issues(df: pd.DataFrame, check: str, expected: str, found: str) -> pd.DataFrame:
+    return pd.DataFrame(dict(
+        dataset=df.dataset,
+        number=df.number,
+        mc=df.mc,
+        check=check,
+        expected=df[expected].astype(str),
+        found=df[found].astype(str),
+    ))
+
+
+def check_batch(pieces: List[Piece]) -> pd.DataFrame:
+    """Runs all checks on a batch of pieces and returns one row per issue."""
+    measures, measure_maps, notes = load_batch(pieces)
+    key = ['dataset', 'number']
+    issues = []
+
+    # measures vs. measure maps
+    n_measures = measures.groupby(key).size().rename('expected')
+    n_entries = measure_maps.groupby(key).size().rename('found')
+    counts = pd.concat([n_measures, n_entries.reindex(n_measures.index).fillna(0).astype(int)], axis=1)
+    counts = counts[counts.expected != counts.found].reset_index().assign(mc=pd.NA)
+    issues.append(make_issues(counts, 'n_measures', 'expected', 'found'))
+
+    merged = measures.merge(measure_maps, on=key + ['mc'], how='inner', suffixes=('', '_mm'))
+    repeats = merged.repeats.fillna('')
+    merged['start_repeat_tsv'] = repeats.isin(['start', 'startend'])
+    merged['end_repeat_tsv'] = repeats.isin(['end', 'startend'])
+    merged['next_tsv'] = normalize_next(merged.next)
+    merged['start_repeat'] = merged.start_repeat.astype(bool)
+    merged['end_repeat'] = merged.end_repeat.astype(bool)
+    # a missing actual_length (or act_dur) is reported like a missing time_signature
+    act_dur_matches = ((merged.act_dur - merged.actual_length.astype(float)).abs() <= TOLERANCE).fillna(False)
+    for check, tsv_column, mm_column, mismatch in (
+            ('act_dur', 'act_dur', 'actual_length', ~act_dur_matches),
+            ('timesig', 'timesig', 'time_signature', merged.timesig != merged.time_signature),
+            ('start_repeat', 'start_repeat_tsv', 'start_repeat', merged.start_repeat_tsv != merged.start_repeat),
+            ('end_repeat', 'end_repeat_tsv', 'end_repeat', merged.end_repeat_tsv != merged.end_repeat),
+            ('next', 'next_tsv', 'next_mm', merged.next_tsv != merged.next_mm),
+    ):
+        issues.append(make_issues(merged[mismatch], check, tsv_column, mm_column))
+
+    # notes vs. measures
+    if notes.empty:
+        return pd.concat(issues, ignore_index=True)[ISSUE_COLUMNS]
+    notes = notes.merge(measures[key + ['mc', 'act_dur']], on=key + ['mc'], how='left')
+    notes['offset'] = notes.onset + notes.duration_qb
+    missing_mc = notes.act_dur.isna()
+    issues.append(make_issues(notes[missing_mc].assign(expected='measure'), 'note_mc', 'expected', 'mc'))
+    notes = notes[~missing_mc]
+    issues.append(make_issues(notes[notes.onset < -TOLERANCE].assign(zero=0.0), 'note_onset', 'zero', 'onset'))
+    issues.append(make_issues(notes[notes.offset > notes.act_dur + TOLERANCE], 'note_offset', 'act_dur', 'offset'))
+    return pd.concat(issues, ignore_index=True)[ISSUE_COLUMNS]
+
+
+def get_pieces(data_folder: Optional[str] = None) -> List[Piece]:
+    """Lists, for every dataset, all pieces that have a measures table, together with their measure map and notes
+    (None if missing)."""
+    manifest = get_manifest() if data_folder is None else get_manifest(data_folder)
+    pieces = []
+    for dataset in DATASETS:
+        measure_maps = manifest.get_files(dataset, 'measuremap')
+        notes = manifest.get_files(dataset, 'notes')
+        for number, measures_path in manifest.get_files(dataset, 'measures').items():
+            pieces.append((dataset, number, measures_path, measure_maps.get(number), notes.get(number)))
+    return pieces
+
+
+def cross_validate(pieces: Optional[List[Piece]] = None,
+                   batch_size: int = 50,
+                   max_workers: Optional[int] = None) -> pd.DataFrame:
+    """Runs check_batch() in parallel on batches of pieces and returns all issues."""
+    if pieces is None:
+        pieces = get_pieces()
+    batches = [pieces[i:i + batch_size] for i in range(0, len(pieces), batch_size)]
+    if max_workers == 1:
+        results = [check_batch(batch) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(check_batch, batches))
+    return pd.concat(results, ignore_index=True)
+
+
+def summarize_issues(issues: pd.DataFrame, pieces: List[Piece]) -> pd.DataFrame:
+    """Returns a table with one row per dataset and one column per check, counting the pieces that have at least one
+    issue, plus the total number of pieces checked."""
+    n_pieces = pd.Series([dataset for dataset, *_ in pieces]).value_counts().rename('pieces')
+    affected = issues.groupby(['dataset', 'check']).number.nunique().unstack()
+    summary = pd.concat([n_pieces, affected.reindex(columns=CHECKS)], axis=1).reindex(list(DATASETS))
+    return summary.fillna(0).astype(int).rename_axis('dataset')
+
+
+def main(args: argparse.Namespace):
+    pieces = get_pieces(args.data)
+    issues = cross_validate(pieces, batch_size=args.batch_size, max_workers=args.jobs)
+    print("Number of pieces with at least one issue per check:")
+    print(summarize_issues(issues, pieces).to_string())
+    if len(issues):
+        per_piece = issues.groupby(['dataset', 'number', 'check']).size().unstack(fill_value=0)
+        print(f"\n{len(per_piece)} pieces with issues (number of affected measures/notes):")
+        print(per_piece.to_string())
+    if args.output:
+        issues.to_csv(args.output, sep='\t', index=False)
+        print(f"\nStored {len(issues)} issues as {args.output}")
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Checks measures, measure maps and notes for consistency.")
+    parser.add_argument("-d", "--data", default=None, help="Path of the data folder. Defaults to ../data")
+    parser.add_argument("-o", "--output", default=None, help="Store all issues in this TSV file.")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of worker processes. Defaults to the number of CPUs.")
+    parser.add_argument("--batch_size", type=int, default=50, help="Number of pieces per batch.")
+    return parser
+
+
+if __name__ == "__main__":
+    main(get_arg_parser().parse_args())
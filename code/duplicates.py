@@ -0,0 +1,179 @@
+"""This file contains a similarity join for finding duplicate and near-duplicate chorales, i.e. all pairs of pieces
+whose pitch-class vectors (PCVs) lie within a given summed absolute error (the distance used in 03_compare_pcvs.py).
+
+Instead of comparing all n² pairs, the pieces are sorted by the total duration of their PCVs: the summed absolute
+error of two PCVs is at least the difference of their totals, so each piece only needs to be compared with the
+following pieces whose total exceeds its own by at most the threshold. This pruning is exact, i.e. the result is the
+same as that of find_all_pairs().
+
+Optionally (`--keysig`), pieces are additionally blocked by the key signature of their first measure. This is not
+exact: the first `keysig` of the `measures` tables is not always the key signature of the piece (e.g. the identical
+vectors of cap 199 and 302 have 0 and -1), so pairs may be missed.
+
+The pairs found are grouped into clusters (connected components). Run as a script, e.g.
+
+    python duplicates.py --pcvs tpc_pcvs --threshold 0 --datasets krn
+
+prints the clusters of each dataset; `--merged` treats all datasets as one corpus.
+"""
+
+import argparse
+import os
+from typing import Dict, Hashable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from manifest import DATA_FOLDER, DATASETS, get_manifest
+
+PCV_FOLDER = "tpc_pcvs"
+PAIR_COLUMNS = ['a', 'b', 'distance']
+
+
+def get_keysigs(dataset: str, data_folder: str = DATA_FOLDER) -> pd.Series:
+    """Returns the key signature of the first measure of each piece, indexed like the PCV tables (zero-padded strings
+    for krn are parsed as integers by pd.read_csv, too)."""
+    keysigs = {}
+    for number, filepath in get_manifest(data_folder).get_files(dataset, 'measures').items():
+        first_row = pd.read_csv(filepath, sep='\t', usecols=['keysig'], nrows=1)
+        keysigs[number] = first_row.keysig.iloc[0] if len(first_row) else pd.NA
+    return pd.Series(keysigs, name='keysig')
+
+
+def iter_candidate_distances(values: np.ndarray, totals: np.ndarray, threshold: float) -> Iterator[tuple]:
+    """Yields (i, j, distance) for all pairs of rows i < j of one block whose summed absolute error is <= threshold.
+    The rows need to be sorted by their totals."""
+    upper = np.searchsorted(totals, totals + threshold, side='right')
+    for i in range(len(values) - 1):
+        end = upper[i]
+        if end <= i + 1:
+            continue
+        distances = np.abs(values[i + 1:end] - values[i]).sum(axis=1)
+        for offset in np.flatnonzero(distances <= threshold):
+            yield i, i + 1 + offset, distances[offset]
+
+
+def find_similar_pairs(pcvs: pd.DataFrame,
+                       threshold: float = 0.0,
+                       blocks: Optional[pd.Series] = None) -> pd.DataFrame:
+    """Returns all pairs of pieces (rows) whose PCVs differ by a summed absolute error of at most `threshold`,
+    considering only pairs with the same value in `blocks` (e.g. key signature; NA forms a block of its own). Rows
+    that are all zero or NaN are ignored, like in 03_compare_pcvs.py."""
+    pcvs = pcvs[~(pcvs.isna() | (pcvs == 0)).all(axis=1)]
+    values = pcvs.fillna(0.0).to_numpy(dtype=float)
+    totals = values.sum(axis=1)
+    if blocks is None:
+        block_ids = np.zeros(len(pcvs), dtype=int)
+    else:
+        block_ids = pd.factorize(blocks.reindex(pcvs.index), use_na_sentinel=False)[0]
+    pairs = []
+    for block_id in np.unique(block_ids):
+        positions = np.flatnonzero(block_ids == block_id)
+        positions = positions[np.argsort(totals[positions], kind='stable')]
+        for i, j, distance in iter_candidate_distances(values[positions], totals[positions], threshold):
+            a, b = sorted((positions[i], positions[j]))
+            pairs.append((pcvs.index[a], pcvs.index[b], distance))
+    result = pd.DataFrame(pairs, columns=PAIR_COLUMNS)
+    return result.sort_values(PAIR_COLUMNS, ignore_index=True)
+
+
+def find_all_pairs(pcvs: pd.DataFrame, threshold: float = 0.0) -> pd.DataFrame:
+    """The same without blocking, comparing all n² pairs. For validating find_similar_pairs()."""
+    pcvs = pcvs[~(pcvs.isna() | (pcvs == 0)).all(axis=1)]
+    values = pcvs.fillna(0.0).to_numpy(dtype=float)
+    pairs = [(pcvs.index[i], pcvs.index[j], distance)
+             for i in range(len(values))
+             for j, distance in enumerate(np.abs(values - values[i]).sum(axis=1))
+             if i < j and distance <= threshold]
+    return pd.DataFrame(pairs, columns=PAIR_COLUMNS).sort_values(PAIR_COLUMNS, ignore_index=True)
+
+
+def get_clusters(pairs: pd.DataFrame) -> pd.DataFrame:
+    """Groups the pieces into connected components and returns one row per cluster with its members, the number of
+    pairs within the threshold, and their minimal and maximal distance. Sorted by size and first member."""
+    parent: Dict[Hashable, Hashable] = {}
+
+    def find(x):
+        while parent.setdefault(x, x) != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in zip(pairs.a, pairs.b):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+    if not parent:
+        return pd.DataFrame(columns=['members', 'n_members', 'n_pairs', 'min_distance', 'max_distance'])
+    roots = pairs.a.map(find)
+    members: Dict[Hashable, List[Hashable]] = {}
+    for piece in parent:
+        members.setdefault(find(piece), []).append(piece)
+    distances = pairs.groupby(roots).distance
+    clusters = pd.DataFrame(dict(
+        members=pd.Series({root: sorted(pieces) for root, pieces in members.items()}),
+        n_members=pd.Series({root: len(pieces) for root, pieces in members.items()}),
+        n_pairs=distances.size(),
+        min_distance=distances.min(),
+        max_distance=distances.max(),
+    ))
+    clusters = clusters.sort_index().sort_values('n_members', ascending=False, kind='stable')
+    return clusters.reset_index(drop=True).rename_axis('cluster')
+
+
+def load_pcvs(dataset: str, pcv_folder: str = PCV_FOLDER) -> pd.DataFrame:
+    return pd.read_csv(os.path.join(pcv_folder, f"{dataset}.csv"), index_col=0)
+
+
+def load_merged_corpus(datasets: List[str], pcv_folder: str = PCV_FOLDER, keysig: bool = False):
+    """Concatenates the PCVs (and key signatures) of several datasets into one corpus, indexed by 'dataset:number'."""
+    pcvs, keysigs = [], []
+    for dataset in datasets:
+        df = load_pcvs(dataset, pcv_folder)
+        df.index = [f"{dataset}:{number}" for number in df.index]
+        pcvs.append(df)
+        if keysig:
+            S = get_keysigs(dataset)
+            S.index = [f"{dataset}:{number}" for number in S.index]
+            keysigs.append(S)
+    merged = pd.concat(pcvs).fillna(0.0)
+    return merged, (pd.concat(keysigs) if keysig else None)
+
+
+def main(args: argparse.Namespace):
+    if args.merged:
+        corpora = {"+".join(args.datasets): load_merged_corpus(args.datasets, args.pcvs, keysig=args.keysig)}
+    else:
+        corpora = {dataset: (load_pcvs(dataset, args.pcvs), get_keysigs(dataset) if args.keysig else None)
+                   for dataset in args.datasets}
+    all_pairs = []
+    for name, (pcvs, keysigs) in corpora.items():
+        pairs = find_similar_pairs(pcvs, threshold=args.threshold, blocks=keysigs)
+        clusters = get_clusters(pairs)
+        print(f"\n{name}: {len(pairs)} pairs of {len(pcvs)} pieces with a distance <= {args.threshold}, "
+              f"forming {len(clusters)} clusters:")
+        if len(clusters):
+            print(clusters.to_string())
+        all_pairs.append(pairs.assign(corpus=name))
+    if args.output:
+        pd.concat(all_pairs, ignore_index=True).to_csv(args.output, sep='\t', index=False)
+        print(f"\nStored all pairs as {args.output}")
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Finds duplicate and near-duplicate chorales based on their "
+                                                 "pitch-class vectors.")
+    parser.add_argument("-t", "--threshold", type=float, default=0.0,
+                        help="Maximal summed absolute error between two PCVs. Defaults to 0 (identical PCVs).")
+    parser.add_argument("-p", "--pcvs", default=PCV_FOLDER, help=f"Folder with the PCV tables. Defaults to "
+                                                                 f"{PCV_FOLDER} (complete pieces).")
+    parser.add_argument("-d", "--datasets", nargs="+", default=list(DATASETS), choices=list(DATASETS))
+    parser.add_argument("--merged", action="store_true", help="Treat the datasets as one corpus.")
+    parser.add_argument("--keysig", action="store_true", help="Only compare pieces with the same key signature in "
+                                                              "their first measure. Faster, but may miss pairs.")
+    parser.add_argument("-o", "--output", default=None, help="Store all pairs in this TSV file.")
+    return parser
+
+
+if __name__ == "__main__":
+    main(get_arg_parser().parse_args())
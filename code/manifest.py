@@ -0,0 +1,237 @@
+"""This file contains the manifest of the `data` folder, i.e. one entry per dataset file (scores, notes, measures,
+measure maps, metadata) with the catalogue number it corresponds to. The numbers are those used by the dataset's
+filenames: corrected CPE numbers for `cap` (see utils.parse_cpe_filename()) and Riemenschneider numbers for `krn`
+and `xml`.
+
+The manifest is built with a single os.scandir() walk and cached on disk together with the modification times of
+all directories it has walked. As long as none of them has changed, the cached manifest is used without listing any
+directory again.
+"""
+
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from utils import parse_cpe_filename
+
+DATA_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "data"))
+CACHE_FILENAME = ".manifest.json"
+CACHE_VERSION = 1
+
+DATASETS = dict(
+    cap="DCMLab_cap",
+    krn="craigsapp_krn",
+    xml="MarkGotham_xml",
+)
+
+ROLE_SUFFIXES = (
+    # order matters because '.tsv' would match the first two as well
+    (".notes.tsv", "notes"),
+    (".measures.tsv", "measures"),
+    (".mm.json", "measuremap"),
+    (".mscz", "score"),
+    (".mscx", "score"),
+    (".mxl", "score"),
+    (".musicxml", "score"),
+)
+
+
+class ManifestEntry(NamedTuple):
+    dataset: str
+    role: str
+    number: Optional[int]
+    variant: str
+    path: str
+    """Relative to the data folder."""
+
+
+def split_role(fname: str) -> Optional[Tuple[str, str]]:
+    """Returns (stem, role) for a filename or None if the file does not play any role in the pipeline."""
+    if fname == "metadata.tsv":
+        return "metadata", "metadata"
+    for suffix, role in ROLE_SUFFIXES:
+        if fname.endswith(suffix):
+            return fname[:-len(suffix)], role
+    return None
+
+
+def parse_number(dataset: str, stem: str) -> Optional[int]:
+    """Returns the catalogue number encoded in a file stem of the given dataset or None."""
+    if dataset == "cap":
+        parsed = parse_cpe_filename(stem)
+        return None if parsed is None else parsed[0]
+    if dataset == "krn":
+        stem = stem[4:] if stem.startswith("chor") else ""
+    if len(stem) == 3 and stem.isdigit():
+        return int(stem)
+    return None
+
+
+def parse_aligned_file(dataset: str, rel_path: str) -> Optional[int]:
+    """Returns the catalogue number of a file as listed in aligned_files.csv, e.g. 'chor001.krn',
+    '001 Aus meines Herzens Grunde.mscx', or '001/short_score.mxl' (where the folder encodes the number)."""
+    if not isinstance(rel_path, str):
+        return None
+    directory, fname = os.path.split(rel_path)
+    number = parse_number(dataset, os.path.splitext(fname)[0])
+    if number is None and directory:
+        number = parse_number(dataset, os.path.basename(directory))
+    return number
+
+
+def make_entry(dataset: str, rel_dirs: Tuple[str, ...], fname: str) -> Optional[ManifestEntry]:
+    """Turns a file found in the directory `rel_dirs` (relative to the dataset folder) into a ManifestEntry.
+    Subdirectories are reflected in the `variant`, e.g. 'kern' for the measure maps in
+    craigsapp_krn/measuremaps/kern or 'analysis' for MarkGotham_xml/measuremaps/001/analysis.mm.json.
+    """
+    split = split_role(fname)
+    if split is None:
+        return None
+    stem, role = split
+    path = os.path.join(DATASETS[dataset], *rel_dirs, fname)
+    if role == "metadata":
+        return ManifestEntry(dataset, role, None, "", path)
+    # the first directory level corresponds to the type of file (MS3, notes, measuremaps etc.)
+    sub_dirs = rel_dirs[1:] if role != "score" or dataset != "xml" else rel_dirs[2:]
+    number = parse_number(dataset, stem)
+    if number is None and sub_dirs:
+        # files grouped in a folder per piece, e.g. measuremaps/001/analysis.mm.json
+        number = parse_number(dataset, sub_dirs[-1])
+        variant = "/".join(sub_dirs[:-1] + (stem,))
+    else:
+        variant = "/".join(sub_dirs)
+    return ManifestEntry(dataset, role, number, variant, path)
+
+
+def scan_dataset(data_folder: str, dataset: str) -> Tuple[List[ManifestEntry], Dict[str, float]]:
+    """Walks the dataset folder once, returning the manifest entries and the mtimes of all walked directories."""
+    entries, mtimes = [], {}
+    stack = [()]
+    while stack:
+        rel_dirs = stack.pop()
+        directory = os.path.join(data_folder, DATASETS[dataset], *rel_dirs)
+        mtimes[os.path.relpath(directory, data_folder)] = os.stat(directory).st_mtime
+        with os.scandir(directory) as it:
+            for dir_entry in it:
+                if dir_entry.name.startswith("."):
+                    continue
+                if dir_entry.is_dir():
+                    stack.append(rel_dirs + (dir_entry.name,))
+                    continue
+                entry = make_entry(dataset, rel_dirs, dir_entry.name)
+                if entry is not None:
+                    entries.append(entry)
+    return entries, mtimes
+
+
+class Manifest:
+    """Index of all dataset files. Paths returned by the methods are absolute."""
+
+    def __init__(self, data_folder: str, entries: List[ManifestEntry], mtimes: Dict[str, float]):
+        self.data_folder = data_folder
+        self.entries = entries
+        self.mtimes = mtimes
+        self._index: Dict[Tuple[str, str, str], Dict[int, str]] = {}
+        for entry in entries:
+            if entry.number is None:
+                continue
+            files = self._index.setdefault((entry.dataset, entry.role, entry.variant), {})
+            files[entry.number] = os.path.join(data_folder, entry.path)
+
+    def get_files(self, dataset: str, role: str, variant: str = "") -> Dict[int, str]:
+        """Returns {number -> absolute path}, sorted by number."""
+        files = self._index.get((dataset, role, variant), {})
+        return dict(sorted(files.items()))
+
+    def get_path(self, dataset: str, role: str, number: int, variant: str = "") -> Optional[str]:
+        return self._index.get((dataset, role, variant), {}).get(number)
+
+    def get_aligned_files(self,
+                          dataset: str,
+                          role: str,
+                          aligned_files: Iterable[Tuple[int, str]],
+                          variant: str = "") -> Dict[int, Optional[str]]:
+        """Takes (key, filename) pairs such as the items of a column of aligned_files.csv and returns
+        {key -> absolute path of the corresponding file with the given role, or None if it does not exist}."""
+        files = self._index.get((dataset, role, variant), {})
+        return {key: files.get(parse_aligned_file(dataset, rel_path)) for key, rel_path in aligned_files}
+
+    def get_metadata_path(self, dataset: str) -> str:
+        return os.path.join(self.data_folder, DATASETS[dataset], "metadata.tsv")
+
+    def iter_variants(self, dataset: str, role: str) -> Iterator[str]:
+        for ds, r, variant in self._index:
+            if ds == dataset and r == role:
+                yield variant
+
+    def is_up_to_date(self) -> bool:
+        """Checks only the directories' modification times, which change whenever files are added, removed or
+        renamed."""
+        try:
+            return all(os.stat(os.path.join(self.data_folder, directory)).st_mtime == mtime
+                       for directory, mtime in self.mtimes.items())
+        except FileNotFoundError:
+            return False
+
+    def to_json(self, filepath: str):
+        with open(filepath, "w", encoding="utf-8") as f:
+            json.dump(dict(
+                version=CACHE_VERSION,
+                mtimes=self.mtimes,
+                entries=[list(entry) for entry in self.entries],
+            ), f)
+
+    @classmethod
+    def from_json(cls, data_folder: str, filepath: str) -> Optional["Manifest"]:
+        try:
+            with open(filepath, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get("version") != CACHE_VERSION:
+            return None
+        entries = [ManifestEntry(*entry) for entry in cached["entries"]]
+        return cls(data_folder, entries, cached["mtimes"])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f"Manifest({self.data_folder!r}, {len(self)} entries)"
+
+
+_MANIFESTS: Dict[str, Manifest] = {}
+
+
+def build_manifest(data_folder: str = DATA_FOLDER) -> Manifest:
+    data_folder = os.path.abspath(data_folder)
+    entries, mtimes = [], {}
+    for dataset in DATASETS:
+        dataset_entries, dataset_mtimes = scan_dataset(data_folder, dataset)
+        entries.extend(dataset_entries)
+        mtimes.update(dataset_mtimes)
+    entries.sort(key=lambda e: (e.dataset, e.role, e.variant, e.number or 0, e.path))
+    return Manifest(data_folder, entries, mtimes)
+
+
+def get_manifest(data_folder: str = DATA_FOLDER, use_cache: bool = True) -> Manifest:
+    """Returns the manifest for the data folder, building it only if neither the in-memory nor the on-disk cache
+    (stored as .manifest.json in the data folder) is up to date.
+    """
+    data_folder = os.path.abspath(data_folder)
+    cache_path = os.path.join(data_folder, CACHE_FILENAME)
+    if use_cache:
+        manifest = _MANIFESTS.get(data_folder)
+        if manifest is None:
+            manifest = Manifest.from_json(data_folder, cache_path)
+        if manifest is not None and manifest.is_up_to_date():
+            _MANIFESTS[data_folder] = manifest
+            return manifest
+    manifest = build_manifest(data_folder)
+    _MANIFESTS[data_folder] = manifest
+    if use_cache:
+        try:
+            manifest.to_json(cache_path)
+        except OSError as e:
+            print(f"Could not store the manifest cache as {cache_path}: {e!r}")
+    return manifest
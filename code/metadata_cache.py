@@ -0,0 +1,196 @@
+"""This file contains the helpers that let 01_prepare_metadata.py run offline and skip work whose inputs have not
+changed:
+
+* read_sortable_table() streams an HTML file through the standard library's HTMLParser, collects only the rows of
+  the table with the requested id, and stops reading as soon as that table is closed. The result is identical to
+  `pd.read_html(..., attrs=dict(id=table_id))[0]` but requires neither lxml nor bs4 and does not build a DOM.
+* cached_table() stores intermediate DataFrames as pickles in `code/.metadata_cache`, keyed on the SHA-1 of their
+  source files, so that the dtypes survive and parsing is repeated only when a source has changed.
+* is_stage_up_to_date() and record_stage() compare the hashes of a stage's inputs and outputs with those stored after
+  its last run.
+"""
+
+import hashlib
+import json
+import os
+import re
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+from utils import hash_sources
+
+CACHE_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), ".metadata_cache")
+CACHE_VERSION = 1
+# same as pandas.io.html._RE_WHITESPACE, applied to each cell's text
+RE_WHITESPACE = re.compile(r"[\r\n]+|\s{2,}")
+
+
+class SortableTableParser(HTMLParser):
+    """Collects the text of the cells of the first <table> with the given id, one list of strings per row, separately
+    for <thead> and the rest. Sets `done` once the table has been closed."""
+
+    def __init__(self, table_id: str = "sortable"):
+        super().__init__(convert_charrefs=True)
+        self.table_id = table_id
+        self.header_rows: List[List[str]] = []
+        self.body_rows: List[List[str]] = []
+        self.done = False
+        self.depth = 0  # nesting level of <table> elements within the target table
+        self.in_thead = False
+        self.row: Optional[List[str]] = None
+        self.cell: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if self.depth == 0:
+            if tag == "table" and dict(attrs).get("id") == self.table_id:
+                self.depth = 1
+            return
+        if tag == "table":
+            self.depth += 1
+        elif tag == "thead":
+            self.in_thead = True
+        elif tag in ("tbody", "tfoot"):
+            self.in_thead = False
+        elif tag == "tr":
+            self.end_row()
+            self.row = []
+        elif tag in ("td", "th"):
+            self.end_cell()
+            self.cell = []
+        elif tag == "br" and self.cell is not None:
+            # pd.read_html() turns line breaks into whitespace, too
+            self.cell.append("\n")
+
+    def handle_endtag(self, tag):
+        if self.depth == 0 or self.done:
+            return
+        if tag == "table":
+            self.depth -= 1
+            if self.depth == 0:
+                self.end_row()
+                self.done = True
+        elif tag == "thead":
+            self.end_row()
+            self.in_thead = False
+        elif tag == "tr":
+            self.end_row()
+        elif tag in ("td", "th"):
+            self.end_cell()
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell.append(data)
+
+    def end_cell(self):
+        if self.cell is None or self.row is None:
+            return
+        self.row.append(RE_WHITESPACE.sub(" ", "".join(self.cell).strip()))
+        self.cell = None
+
+    def end_row(self):
+        self.end_cell()
+        if self.row is None:
+            return
+        (self.header_rows if self.in_thead else self.body_rows).append(self.row)
+        self.row = None
+
+
+def read_sortable_table(filepath: str,
+                        table_id: str = "sortable",
+                        na_values: Sequence[str] = ("9999", "ZZZZ"),
+                        chunk_size: int = 1 << 16) -> pd.DataFrame:
+    """Equivalent to pd.read_html(html, na_values=na_values, attrs=dict(id=table_id))[0] for tables without colspan
+    and rowspan, reading the file only up to the end of the table."""
+    parser = SortableTableParser(table_id)
+    with open(filepath, "r", encoding="utf-8") as f:
+        for chunk in iter(lambda: f.read(chunk_size), ""):
+            parser.feed(chunk)
+            if parser.done:
+                break
+    parser.close()
+    if not parser.done and not parser.body_rows:
+        raise ValueError(f"No table with id={table_id!r} found in {filepath}")
+    header = parser.header_rows
+    if not header:
+        # like pd.read_html(), use the leading rows consisting of <th> elements only; here: the first row
+        header, body = parser.body_rows[:1], parser.body_rows[1:]
+    else:
+        body = parser.body_rows
+    rows = header[-1:] + body
+    # fill up "ragged" rows like pandas.io.html._expand_elements()
+    width = max(len(row) for row in rows)
+    rows = [row + [""] * (width - len(row)) for row in rows]
+    with TextParser(rows, header=0, thousands=",", na_values=list(na_values), keep_default_na=True) as tp:
+        return tp.read()
+
+
+def hash_strings(strings: Iterable[str]) -> str:
+    h = hashlib.sha1()
+    for string in strings:
+        h.update(string.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def get_cache_key(sources: Sequence[str], keys: Iterable[str] = ()) -> str:
+    """Hashes the contents of the source files together with additional strings, e.g. a list of filenames."""
+    return hash_strings([str(CACHE_VERSION), hash_sources(sources), *keys])
+
+
+def cached_table(name: str,
+                 sources: Sequence[str],
+                 compute: Callable[[], pd.DataFrame],
+                 keys: Iterable[str] = ()) -> pd.DataFrame:
+    """Returns the DataFrame computed by `compute` from the given source files, loading it from the cache if neither
+    the sources nor the additional `keys` have changed since it was stored."""
+    cache_path = os.path.join(CACHE_FOLDER, f"{name}-{get_cache_key(sources, keys)[:16]}.pkl")
+    if os.path.isfile(cache_path):
+        return pd.read_pickle(cache_path)
+    df = compute()
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    for fname in os.listdir(CACHE_FOLDER):
+        if fname.startswith(name + "-") and fname.endswith(".pkl"):
+            os.remove(os.path.join(CACHE_FOLDER, fname))
+    df.to_pickle(cache_path)
+    return df
+
+
+def get_stage_path(stage: str) -> str:
+    return os.path.join(CACHE_FOLDER, f"{stage}.json")
+
+
+def get_stage_state(inputs: Sequence[str], outputs: Sequence[str], keys: Iterable[str] = ()) -> Dict[str, str]:
+    return dict(
+        inputs=get_cache_key(inputs, keys),
+        **{output: hash_sources([output]) for output in outputs},
+    )
+
+
+def is_stage_up_to_date(stage: str,
+                        inputs: Sequence[str],
+                        outputs: Sequence[str],
+                        keys: Iterable[str] = ()) -> bool:
+    """True if all outputs exist and neither they nor the inputs have changed since record_stage() was called."""
+    if not all(os.path.isfile(output) for output in outputs):
+        return False
+    try:
+        with open(get_stage_path(stage), "r", encoding="utf-8") as f:
+            recorded = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return recorded == get_stage_state(inputs, outputs, keys)
+
+
+def record_stage(stage: str,
+                 inputs: Sequence[str],
+                 outputs: Sequence[str],
+                 keys: Iterable[str] = ()):
+    """Stores the hashes of the inputs and outputs of a stage that has just been run."""
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    with open(get_stage_path(stage), "w", encoding="utf-8") as f:
+        json.dump(get_stage_state(inputs, outputs, keys), f, indent=2)
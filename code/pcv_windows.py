@@ -0,0 +1,174 @@
+"""This file contains prefix sums for computing pitch-class vectors (PCVs) of arbitrary windows of a piece. A
+PrefixPCV is built once per notes table and holds, for each TPC, the cumulative durations (and note counts)
+
+* by note onset, in quarter notes from the beginning (`quarterbeats_all_endings`), and
+* by MC.
+
+The PCV of any window, e.g. the first k quarter notes, MCs i..j, or the passage between two fermatas (given as
+quarterbeat positions, since the notes tables do not encode fermatas), is then the difference of two rows, without
+filtering the notes table again. As in get_pcv() in 02_make_pcvs.py, notes belong to a window if their onset lies
+within it and contribute their complete duration.
+
+Since all durations are dyadic fractions (at most 1/32 of a whole note), the float prefix sums are exact and the PCVs
+are identical to those summed up by get_pcv(). Run as a script to generate the PCV folders for several numbers of
+MCs at once, e.g. `python pcv_windows.py --n_mcs 1 2 3 0` (0 for complete pieces).
+"""
+
+import argparse
+import os
+from fractions import Fraction
+from typing import Dict, Iterable, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from manifest import DATA_FOLDER, DATASETS, get_manifest
+from score_notes import load_score_notes
+
+ONSET_COLUMN = "quarterbeats_all_endings"
+TSV_COLUMNS = ["mc", "mn_onset", "duration_qb", "tpc", ONSET_COLUMN]
+Key = Union[int, str]
+
+
+def to_float(values: Iterable) -> np.ndarray:
+    """Converts Fractions or strings such as '3/2' to floats."""
+    return np.array([float(Fraction(value)) for value in values], dtype=float)
+
+
+def cumulative_table(positions: np.ndarray,
+                     columns: np.ndarray,
+                     values: np.ndarray,
+                     n_rows: int,
+                     n_columns: int) -> np.ndarray:
+    """Returns an (n_rows + 1) x n_columns array whose row k sums up the values of all notes with position < k."""
+    table = np.zeros((n_rows + 1, n_columns), dtype=values.dtype)
+    np.add.at(table, (positions + 1, columns), values)
+    return table.cumsum(axis=0)
+
+
+class PrefixPCV:
+    """Prefix sums of the TPC durations of one piece. All window methods return a Series {tpc -> duration} containing
+    the TPCs of all notes in the window, like get_pcv()."""
+
+    __slots__ = ('tpcs', 'onsets', 'onset_durations', 'onset_counts', 'n_mcs', 'mc_durations', 'mc_counts',
+                 'has_anacrusis')
+
+    def __init__(self, notes: pd.DataFrame, column: str = 'tpc'):
+        """Takes a notes table with the columns `mc`, `mn_onset`, `duration_qb`, `column`, and, for onset windows,
+        `quarterbeats_all_endings`, as stored by ms3 or returned by score_notes.load_score_notes()."""
+        # same condition as in get_pcv()
+        self.has_anacrusis = len(notes) > 0 and Fraction(notes.mn_onset.iloc[0]) >= 2
+        notes = notes[notes[column].notna()]
+        self.tpcs, tpc_codes = np.unique(notes[column].to_numpy(dtype=int), return_inverse=True)
+        durations = notes.duration_qb.to_numpy(dtype=float)
+        ones = np.ones(len(notes), dtype=np.int32)
+        mcs = notes.mc.to_numpy(dtype=int)
+        self.n_mcs = int(mcs.max()) if len(mcs) else 0
+        # row m covers MCs 1..m
+        self.mc_durations = cumulative_table(mcs - 1, tpc_codes, durations, self.n_mcs, len(self.tpcs))
+        self.mc_counts = cumulative_table(mcs - 1, tpc_codes, ones, self.n_mcs, len(self.tpcs))
+        if ONSET_COLUMN in notes.columns:
+            self.onsets, onset_codes = np.unique(to_float(notes[ONSET_COLUMN]), return_inverse=True)
+            # row k covers the notes with onsets < self.onsets[k]
+            n_onsets, n_tpcs = len(self.onsets), len(self.tpcs)
+            self.onset_durations = cumulative_table(onset_codes, tpc_codes, durations, n_onsets, n_tpcs)
+            self.onset_counts = cumulative_table(onset_codes, tpc_codes, ones, n_onsets, n_tpcs)
+        else:
+            self.onsets = self.onset_durations = self.onset_counts = None
+
+    def _difference(self, durations: np.ndarray, counts: np.ndarray, start_row: int, end_row: int) -> pd.Series:
+        present = counts[end_row] - counts[start_row] > 0
+        pcv = durations[end_row] - durations[start_row]
+        return pd.Series(pcv[present], index=pd.Index(self.tpcs[present], name='tpc'), name='duration_qb')
+
+    def measures(self, first_mc: int = 1, last_mc: Optional[int] = None) -> pd.Series:
+        """PCV of MCs first_mc..last_mc (inclusive)."""
+        last_mc = self.n_mcs if last_mc is None else min(max(last_mc, 0), self.n_mcs)
+        first_mc = min(max(first_mc, 1), last_mc + 1)
+        return self._difference(self.mc_durations, self.mc_counts, first_mc - 1, last_mc)
+
+    def first_mcs(self, n_mcs: Optional[int] = None) -> pd.Series:
+        """Same as get_pcv(notes, n_mcs=n_mcs), i.e. one more MC if the piece begins with an anacrusis, and the
+        complete piece if n_mcs is None or 0."""
+        if not n_mcs:
+            return self.measures()
+        return self.measures(1, n_mcs + 1 if self.has_anacrusis else n_mcs)
+
+    def onset_window(self, start: float = 0.0, end: Optional[float] = None) -> pd.Series:
+        """PCV of the notes with start <= onset < end (in quarter notes from the beginning, counting all endings)."""
+        if self.onsets is None:
+            raise ValueError(f"The notes table has no column {ONSET_COLUMN!r}, only MC windows are available.")
+        start_row = int(np.searchsorted(self.onsets, start, side='left'))
+        end_row = len(self.onsets) if end is None else int(np.searchsorted(self.onsets, end, side='left'))
+        return self._difference(self.onset_durations, self.onset_counts, start_row, max(start_row, end_row))
+
+    def first_quarterbeats(self, k: float) -> pd.Series:
+        """PCV of the notes beginning within the first k quarter notes."""
+        return self.onset_window(0.0, k)
+
+    def __repr__(self):
+        n_onsets = 0 if self.onsets is None else len(self.onsets)
+        return f"PrefixPCV({len(self.tpcs)} TPCs, {self.n_mcs} MCs, {n_onsets} onsets)"
+
+
+def load_notes(filepath: str) -> pd.DataFrame:
+    """Reads only the columns needed for PCVs from a notes TSV file, or the notes from a score."""
+    if filepath.endswith('.tsv'):
+        return pd.read_csv(filepath, sep='\t', usecols=TSV_COLUMNS, dtype=dict(mn_onset=str, **{ONSET_COLUMN: str}))
+    return load_score_notes(filepath)
+
+
+def load_prefix_pcvs(dataset: str,
+                     role: str = 'notes',
+                     data_folder: str = DATA_FOLDER,
+                     column: str = 'tpc') -> Dict[Key, PrefixPCV]:
+    """Builds the prefix sums for all pieces of a dataset, keyed like the PCV tables written by 02_make_pcvs.py
+    (zero-padded strings for krn)."""
+    result = {}
+    for number, filepath in get_manifest(data_folder).get_files(dataset, role).items():
+        key = str(number).zfill(3) if dataset == 'krn' else number
+        result[key] = PrefixPCV(load_notes(filepath), column=column)
+    return result
+
+
+def get_concatenated_pcvs(prefix_pcvs: Dict[Key, PrefixPCV], n_mcs: Optional[int] = 2) -> pd.DataFrame:
+    """Same table as get_concatenated_pcvs() in 02_make_pcvs.py, one row per piece."""
+    pcvs = {key: prefix.first_mcs(n_mcs) for key, prefix in prefix_pcvs.items()}
+    concatenated = pd.concat(pcvs.values(), keys=pcvs.keys())
+    return concatenated.unstack().sort_index().fillna(0.0)
+
+
+def write_pcv_folders(datasets: Iterable[str] = tuple(DATASETS),
+                      n_mcs_values: Iterable[Optional[int]] = (2,),
+                      role: str = 'notes',
+                      column: str = 'tpc',
+                      output_folder: str = '.'):
+    """Builds the prefix sums of each dataset once and writes one PCV table per number of MCs, into the same folders
+    as 02_make_pcvs.py (e.g. tpc_2_pcvs or, for None/0, tpc_pcvs)."""
+    n_mcs_values = list(n_mcs_values)
+    for dataset in datasets:
+        print(f"Building prefix sums for the {DATASETS[dataset]} dataset from {role} files...")
+        prefix_pcvs = load_prefix_pcvs(dataset, role=role, column=column)
+        for n_mcs in n_mcs_values:
+            folder_name = f"{column}_{n_mcs}_pcvs" if n_mcs else f"{column}_pcvs"
+            folder = os.path.join(output_folder, folder_name)
+            os.makedirs(folder, exist_ok=True)
+            file_path = os.path.join(folder, f"{dataset}.csv")
+            get_concatenated_pcvs(prefix_pcvs, n_mcs).to_csv(file_path)
+            print(f"Stored pitch-class vectors as {file_path}")
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Writes PCV tables for several numbers of MCs from prefix sums that "
+                                                 "are built only once per dataset.")
+    parser.add_argument("-n", "--n_mcs", nargs="+", type=int, default=[2],
+                        help="Numbers of MCs, 0 for complete pieces. Defaults to 2.")
+    parser.add_argument("-d", "--datasets", nargs="+", default=list(DATASETS), choices=list(DATASETS))
+    parser.add_argument("--scores", action="store_true", help="Read the notes from the scores instead of the TSV files.")
+    parser.add_argument("-o", "--output", default=".", help="Folder in which to create the PCV folders.")
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_arg_parser().parse_args()
+    write_pcv_folders(args.datasets, args.n_mcs, role='score' if args.scores else 'notes', output_folder=args.output)
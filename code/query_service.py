@@ -0,0 +1,441 @@
+"""This file contains a small local HTTP service that answers queries about the aligned chorales without re-running the
+notebooks. On startup, it loads `riemenschneider.csv`, `../aligned_files.csv`, the pitch-class vectors (PCVs) and the
+measure maps once and keeps them in memory, so that each query is a dictionary lookup or a single numpy operation.
+
+All endpoints accept GET parameters or a JSON object as POST body and return JSON:
+
+* `/lookup`: catalogue records by `R` (Riemenschneider), `bwv`, `cpe`, `file` (name or stem of an aligned file, e.g.
+  `chor006` or `007 Christus, der ist mein Leben.mscx`) or `title` (case-insensitive substring of any title column).
+* `/match`: the best-matching pieces of dataset `against` (default: groundtruth) for the PCV of `dataset` `number` or
+  for a given `pcv` (GET: `pcv=0:0.5,1:5`, POST: `{"pcv": {"0": 0.5, "1": 5}}`), with the semantics of
+  get_best_matches_for_piece() in 03_compare_pcvs.py, i.e. all pieces with the minimal absolute error.
+* `/mm_diff`: quick diagnosis (as in 04_compare_measure_maps.py) of the measure map `preferred` (default: analysis)
+  against `other` (default: all other sources) for piece `R`, plus the first diverging entry. Fields can be excluded
+  from the comparison with `ignore=number,next`.
+* `/batch`: POST only; `{"queries": [{"endpoint": "match", "dataset": "cap", "number": 87}, ...]}` returns one result
+  per query, in the same order: `{"result": ...}` or, if the query failed, `{"error": ...}`.
+
+Invalid queries are answered with status 400, unexpected errors with 500, both as `{"error": ...}`.
+
+Run as a script (from the `code` folder) to start the server:
+
+    python query_service.py [--port 8371]
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+import traceback
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+import compact_measure_maps
+from compact_measure_maps import FIELDS, CompactMeasureMap
+from manifest import get_manifest
+
+CODE_FOLDER = os.path.abspath(os.path.dirname(__file__))
+PCV_FOLDER = "tpc_2_pcvs"  # which pre-computed pitch-class vectors to use, as in 03_compare_pcvs.py
+DEFAULT_PORT = 8371
+
+MD_COLS = dict(
+    cap="cap_file",
+    krn="krn_file",
+    xml="xml_file",
+    groundtruth="krn_title",
+)
+FILE_COLUMNS = ["krn_file", "cap_file", "xml_file"]
+TITLE_COLUMNS = ["krn_title", "Text", "Tune"]
+# (dataset, manifest variant), as loaded in 04_compare_measure_maps.py
+MEASURE_MAP_SOURCES = dict(
+    analysis=("xml", "analysis"),
+    krn_original=("krn", "kern"),
+    krn_musicxml=("krn", "musicxml"),
+    krn_mscz=("krn", ""),
+    xml_original=("xml", "short_score"),
+    xml_mscz=("xml", ""),
+    cap_mscz=("cap", ""),
+)
+# compared by default, as in pymeasuremap.compare.Compare
+DEFAULT_FIELDS = ('count', 'qstamp', 'number', 'time_signature', 'nominal_length', 'actual_length', 'start_repeat',
+                  'end_repeat', 'next')
+
+
+class QueryError(ValueError):
+    """Raised for invalid queries; answered with status 400."""
+
+
+class PCVTable(NamedTuple):
+    numbers: np.ndarray
+    """Row index, i.e. the piece numbers."""
+    values: np.ndarray
+    """One row per piece, one column per TPC (see CorpusIndex.tpcs)."""
+    valid: np.ndarray
+    """False for rows that are all zero or NaN, which never match (like is_null_row() in 03_compare_pcvs.py)."""
+    filenames: List[Optional[str]]
+
+
+def to_json_value(value: Any) -> Any:
+    """Converts numpy scalars and NaN to JSON-serializable values."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def reindex_cpe_with_riemenschneider(df: pd.DataFrame, R: pd.DataFrame) -> pd.DataFrame:
+    """Same as the function of the same name in 03_compare_pcvs.py: the rows up to R. 283 are taken from the CPE
+    number given in the catalogue, all following ones are already aligned."""
+    source_numbers = np.where(R.index <= 283, R.CPE, R.index)
+    result = df.reindex(source_numbers)
+    result.index = R.index
+    return result
+
+
+def parse_pcv(pcv: Any) -> Dict[int, float]:
+    """Accepts {tpc: duration} or a string such as '0:0.5,1:5'."""
+    if isinstance(pcv, str):
+        try:
+            pcv = dict(pair.split(":") for pair in pcv.split(",") if pair)
+        except ValueError:
+            raise QueryError(f"Expected a PCV such as '0:0.5,1:5', got {pcv!r}")
+    if not isinstance(pcv, dict):
+        raise QueryError(f"Expected a PCV as {{tpc: duration}}, got {pcv!r}")
+    try:
+        return {int(tpc): float(duration) for tpc, duration in pcv.items()}
+    except (TypeError, ValueError):
+        raise QueryError(f"TPCs need to be integers and durations numbers, got {pcv!r}")
+
+
+def get_int(params: Dict[str, Any], name: str, default: Optional[int] = None) -> Optional[int]:
+    value = params.get(name, default)
+    if value is None:
+        return None
+    if isinstance(value, (bool, float)):
+        raise QueryError(f"Parameter {name!r} needs to be an integer, got {value!r}")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise QueryError(f"Parameter {name!r} needs to be an integer, got {value!r}")
+
+
+def get_str(params: Dict[str, Any], name: str, default: Optional[str] = None) -> Optional[str]:
+    value = params.get(name, default)
+    if value is not None and not isinstance(value, str):
+        raise QueryError(f"Parameter {name!r} needs to be a string, got {value!r}")
+    return value
+
+
+def get_list(params: Dict[str, Any], name: str) -> List[str]:
+    """Accepts a list of strings or a comma-separated string."""
+    value = params.get(name, [])
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(",") if v.strip()]
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise QueryError(f"Parameter {name!r} needs to be a list of strings, got {value!r}")
+    return list(value)
+
+
+class CorpusIndex:
+    """Read-only in-memory indexes that are shared by all request handlers."""
+
+    def __init__(self,
+                 code_folder: str = CODE_FOLDER,
+                 pcv_folder: str = PCV_FOLDER,
+                 load_measure_maps: bool = True):
+        R = pd.read_csv(os.path.join(code_folder, "riemenschneider.csv"), index_col=0)
+        alignment = pd.read_csv(os.path.join(code_folder, "..", "aligned_files.csv"), index_col=0)
+        self.R = R
+        self.alignment = alignment
+
+        # catalogue
+        catalogue = pd.concat([R.drop(columns=FILE_COLUMNS), alignment[FILE_COLUMNS]], axis=1)
+        self.records: Dict[int, dict] = {
+            int(number): {"Riemenschneider": int(number), **{col: to_json_value(val) for col, val in row.items()}}
+            for number, row in catalogue.iterrows()
+        }
+        self.keys: Dict[str, Dict[str, List[int]]] = dict(bwv={}, cpe={}, file={})
+        for number, row in catalogue.iterrows():
+            for key, values in (
+                    ("bwv", [row.BWV, row.bwv]),
+                    ("cpe", [row.CPE]),
+                    ("file", [name for filename in row[FILE_COLUMNS].dropna()
+                              for name in (filename, os.path.splitext(filename)[0])]),
+            ):
+                for value in values:
+                    if pd.isnull(value):
+                        continue
+                    numbers = self.keys[key].setdefault(str(value).lower(), [])
+                    if number not in numbers:
+                        numbers.append(int(number))
+        self.titles = [(int(number), " | ".join(row.dropna().astype(str)).lower())
+                       for number, row in R[TITLE_COLUMNS].iterrows()]
+
+        # pitch-class vectors
+        pcv_path = os.path.join(code_folder, pcv_folder)
+        dataframes = {}
+        for fname in sorted(os.listdir(pcv_path)):
+            if not fname.endswith(".csv"):
+                continue
+            name = fname[:-4]
+            dataframes[name] = pd.read_csv(os.path.join(pcv_path, fname), index_col=0)
+            if name in ("cap", "xml"):
+                dataframes[name + "_aligned"] = reindex_cpe_with_riemenschneider(dataframes[name], R)
+        dataframes["groundtruth"] = pd.read_csv(os.path.join(code_folder, "groundtruth_pcvs.csv"), index_col=0)
+        filenames = dict(cap_aligned=reindex_cpe_with_riemenschneider(R[["cap_file"]], R).cap_file)
+        for name, column in MD_COLS.items():
+            filenames[name] = R[column]
+        # all tables share the same TPC columns; missing ones are filled with zeros like in fill_up_with_zeros()
+        self.tpcs = sorted({int(col) for df in dataframes.values() for col in df.columns})
+        self.pcvs: Dict[str, PCVTable] = {}
+        for name, df in dataframes.items():
+            df.columns = df.columns.astype(int)
+            values = df.reindex(columns=self.tpcs, fill_value=0.0).to_numpy(dtype=float)
+            valid = ~(np.isnan(values) | (values == 0)).all(axis=1)
+            files = filenames.get(name)
+            file_list = [None] * len(df) if files is None else [to_json_value(f) for f in files.reindex(df.index)]
+            self.pcvs[name] = PCVTable(df.index.to_numpy(), values, valid, file_list)
+
+        # measure maps
+        self.measure_maps: Dict[str, Dict[int, CompactMeasureMap]] = {}
+        if load_measure_maps:
+            self.load_measure_maps(os.path.join(code_folder, "..", "data"))
+
+    def load_measure_maps(self, data_folder: str):
+        """Loads the measure maps of all MEASURE_MAP_SOURCES for all pieces in aligned_files.csv, resolved through
+        the manifest and skipping those that are missing."""
+        manifest = get_manifest(data_folder)
+        for source, (dataset, variant) in MEASURE_MAP_SOURCES.items():
+            filepaths = manifest.get_aligned_files(dataset, "measuremap", self.alignment[f"{dataset}_file"].items(),
+                                                   variant)
+            self.measure_maps[source] = {int(number): CompactMeasureMap.from_json_file(filepath)
+                                         for number, filepath in filepaths.items() if filepath is not None}
+
+    # region queries
+
+    def lookup(self, params: Dict[str, Any]) -> List[dict]:
+        numbers: Optional[List[int]] = None
+        if "R" in params:
+            numbers = [get_int(params, "R")]
+        for key in ("bwv", "cpe", "file"):
+            if key in params:
+                found = self.keys[key].get(str(params[key]).lower(), [])
+                numbers = found if numbers is None else [n for n in numbers if n in found]
+        if "title" in params:
+            substring = str(params["title"]).lower()
+            found = [number for number, titles in self.titles if substring in titles]
+            numbers = found if numbers is None else [n for n in numbers if n in found]
+        if numbers is None:
+            raise QueryError("Specify at least one of the parameters R, bwv, cpe, file, title.")
+        return [self.records[n] for n in numbers if n in self.records]
+
+    def get_pcv_table(self, dataset: str) -> PCVTable:
+        if dataset not in self.pcvs:
+            raise QueryError(f"Unknown dataset {dataset!r}. Available: {list(self.pcvs)}")
+        return self.pcvs[dataset]
+
+    def get_query_pcv(self, params: Dict[str, Any]) -> np.ndarray:
+        if "pcv" in params:
+            pcv = parse_pcv(params["pcv"])
+            unknown = [tpc for tpc, duration in pcv.items() if tpc not in self.tpcs and duration != 0]
+            if unknown:
+                raise QueryError(f"TPCs {unknown} do not occur in any dataset, the admitted range is {self.tpcs}.")
+            return np.array([pcv.get(tpc, 0.0) for tpc in self.tpcs])
+        if "dataset" not in params or "number" not in params:
+            raise QueryError("Specify either 'pcv' or 'dataset' and 'number'.")
+        table = self.get_pcv_table(get_str(params, "dataset"))
+        number = get_int(params, "number")
+        position = np.flatnonzero(table.numbers == number)
+        if not len(position):
+            raise QueryError(f"Dataset {params['dataset']!r} has no piece number {number}.")
+        return table.values[position[0]]
+
+    def match(self, params: Dict[str, Any]) -> dict:
+        """Equivalent to get_best_matches_for_piece(pcv, PCVS[against]) in 03_compare_pcvs.py."""
+        pcv = self.get_query_pcv(params)
+        against = get_str(params, "against", "groundtruth")
+        table = self.get_pcv_table(against)
+        errors = np.nansum(np.abs(table.values - pcv), axis=1)
+        errors[~table.valid] = np.nan
+        if np.isnan(errors).all():
+            return dict(against=against, matches=[])
+        min_val = np.nanmin(errors)
+        matches = [dict(number=int(table.numbers[i]), absolute_error=float(errors[i]), file=table.filenames[i])
+                   for i in np.flatnonzero(errors == min_val)]
+        return dict(against=against, matches=matches)
+
+    def mm_diff(self, params: Dict[str, Any]) -> dict:
+        number = get_int(params, "R")
+        if number is None:
+            raise QueryError("Parameter 'R' is required.")
+        if not self.measure_maps:
+            raise QueryError("The service was started without measure maps.")
+        preferred_source = get_str(params, "preferred", "analysis")
+        other_sources = get_list(params, "other") or [s for s in self.measure_maps if s != preferred_source]
+        for source in [preferred_source] + other_sources:
+            if source not in self.measure_maps:
+                raise QueryError(f"Unknown measure map source {source!r}. Available: {list(self.measure_maps)}")
+        ignore, include = get_list(params, "ignore"), get_list(params, "include")
+        unknown = [field for field in ignore + include if field not in FIELDS]
+        if unknown:
+            raise QueryError(f"Unknown fields {unknown}. Available: {list(FIELDS)}")
+        fields = {field: field in DEFAULT_FIELDS and field not in ignore for field in FIELDS}
+        fields.update({field: True for field in include})
+        entries_threshold = get_int(params, "entries_threshold")
+        preferred = self.measure_maps[preferred_source].get(number)
+        if preferred is None:
+            raise QueryError(f"No {preferred_source!r} measure map for R. {number}.")
+        results = {}
+        for source in other_sources:
+            other = self.measure_maps[source].get(number)
+            if other is None:
+                results[source] = None
+                continue
+            diagnosis = compact_measure_maps.quick_diagnosis(preferred, other, entries_threshold=entries_threshold,
+                                                             **fields)
+            result = dict(diagnosis=diagnosis, n_entries=[preferred.n_entries, other.n_entries])
+            if diagnosis in FIELDS:
+                i = next(i for i, (a, b) in enumerate(zip(preferred.get_field(diagnosis), other.get_field(diagnosis)))
+                         if a != b)
+                result["first_difference"] = dict(entry=i, field=diagnosis,
+                                                  preferred=preferred.get_field(diagnosis)[i],
+                                                  other=other.get_field(diagnosis)[i])
+            results[source] = result
+        return dict(R=number, preferred=preferred_source, results=results)
+
+    def batch(self, params: Dict[str, Any]) -> List[dict]:
+        queries = params.get("queries")
+        if not isinstance(queries, list):
+            raise QueryError("Expected {'queries': [...]}.")
+        results = []
+        for query in queries:
+            try:
+                if not isinstance(query, dict):
+                    raise QueryError(f"Expected a query object, got {query!r}")
+                query = dict(query)
+                endpoint = query.pop("endpoint", None)
+                if endpoint == "batch":
+                    raise QueryError("Batches cannot be nested.")
+                results.append(dict(result=self.query(endpoint, query)))
+            except QueryError as e:
+                results.append(dict(error=str(e)))
+            except Exception as e:
+                traceback.print_exc()
+                results.append(dict(error=f"Internal error: {e!r}"))
+        return results
+
+    # endregion queries
+
+    def query(self, endpoint: Optional[str], params: Dict[str, Any]) -> Any:
+        handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = dict(
+            lookup=self.lookup,
+            match=self.match,
+            mm_diff=self.mm_diff,
+            batch=self.batch,
+        )
+        if not isinstance(endpoint, str) or endpoint not in handlers:
+            raise QueryError(f"Unknown endpoint {endpoint!r}. Available: {list(handlers)}")
+        return handlers[endpoint](params)
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Dispatches /<endpoint> to CorpusIndex.query(). The index is shared through the server object."""
+
+    verbose = False
+
+    def send_json(self, status: HTTPStatus, payload: Any):
+        body = json.dumps(payload, ensure_ascii=False, default=to_json_value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_query(self, params: Dict[str, Any]):
+        endpoint = urlsplit(self.path).path.strip("/")
+        try:
+            result = self.server.index.query(endpoint, params)
+        except QueryError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, dict(error=str(e)))
+            return
+        except Exception as e:
+            traceback.print_exc()
+            self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, dict(error=f"Internal error: {e!r}"))
+            return
+        self.send_json(HTTPStatus.OK, result)
+
+    def do_GET(self):
+        if urlsplit(self.path).path.strip("/") == "batch":
+            self.send_json(HTTPStatus.METHOD_NOT_ALLOWED, dict(error="Batches need to be POSTed."))
+            return
+        query = parse_qs(urlsplit(self.path).query)
+        self.handle_query({name: values[-1] for name, values in query.items()})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length < 0:
+                raise ValueError
+        except ValueError:
+            self.send_json(HTTPStatus.BAD_REQUEST, dict(error="Invalid Content-Length header."))
+            return
+        try:
+            params = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, dict(error=f"Invalid JSON: {e}"))
+            return
+        if not isinstance(params, dict):
+            self.send_json(HTTPStatus.BAD_REQUEST, dict(error="Expected a JSON object."))
+            return
+        self.handle_query(params)
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(index: CorpusIndex, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """Returns a server that handles each request in a separate thread. Call serve_forever() to start it."""
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    server.index = index
+    return server
+
+
+def main(args: argparse.Namespace):
+    start = time.perf_counter()
+    index = CorpusIndex(pcv_folder=args.pcvs, load_measure_maps=not args.no_measure_maps)
+    n_maps = sum(len(maps) for maps in index.measure_maps.values())
+    print(f"Loaded {len(index.records)} catalogue records, {len(index.pcvs)} PCV tables and {n_maps} measure maps in "
+          f"{time.perf_counter() - start:.1f} s.")
+    QueryHandler.verbose = args.verbose
+    server = make_server(index, args.host, args.port)
+    print(f"Serving on http://{args.host}:{server.server_port}/ (endpoints: lookup, match, mm_diff, batch)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Local HTTP service answering catalogue, PCV-match and measure map "
+                                                 "queries about the aligned chorales.")
+    parser.add_argument("--host", default="127.0.0.1", help="Defaults to 127.0.0.1 (local requests only).")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT, help=f"Defaults to {DEFAULT_PORT}.")
+    parser.add_argument("--pcvs", default=PCV_FOLDER, help=f"Folder with the PCVs to match. Defaults to {PCV_FOLDER}.")
+    parser.add_argument("--no_measure_maps", action="store_true", help="Do not load measure maps (disables mm_diff).")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every request.")
+    return parser
+
+
+if __name__ == "__main__":
+    main(get_arg_parser().parse_args())
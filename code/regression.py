@@ -0,0 +1,252 @@
+"""This file contains the regression check for the pipeline. Since the scripts are notebooks, they cannot be tested
+function by function; instead, each stage is run as a whole against the bundled `data` folder and its outputs are
+compared with the committed ("golden") versions:
+
+* `02_make_pcvs.py` (first two measures, from the notes tables and directly from the scores): `tpc_2_pcvs/*.csv`
+* `02_make_pcvs.py` (complete pieces): `tpc_pcvs/*.csv`
+* `03_compare_pcvs.py`: `groundtruth_pcvs.csv` and `../aligned_files.csv`
+* `04_compare_measure_maps.py`: its `summaries_df`, stored as `golden/summaries_df.csv`
+* `convert.py`: runs `check_convert.py`, which exercises the conversion stage with a stub converter (no outputs)
+
+The stages run in a scratch copy of the repository (with a symlink to `data`), so the working tree is never modified.
+A stage fails if one of its outputs differs numerically from the golden file, or if it exceeds its time or memory
+budget (see STAGES). Run from the `code` folder:
+
+    python regression.py [--stages pcvs_2 compare_pcvs] [--update]
+
+The exit code is 1 if any stage failed. After an intended change of the results, `--update` overwrites the golden
+files with the new outputs.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+import pandas as pd
+
+REPO_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# how many times a stage may exceed its time budget before it is killed
+TIMEOUT_FACTOR = 10
+
+
+class Stage(NamedTuple):
+    command: List[str]
+    """Run with the `code` folder of the scratch copy as working directory."""
+    outputs: Dict[str, str]
+    """{output path -> golden path}, both relative to the repository folder."""
+    seconds: float
+    """Wall time budget, roughly three times what the stage takes on a single core."""
+    megabytes: float
+    """Budget for the peak resident memory."""
+    env: Dict[str, str] = {}
+
+
+def pcv_outputs(folder: str) -> Dict[str, str]:
+    return {os.path.join("code", folder, f"{name}.csv"): os.path.join("code", folder, f"{name}.csv")
+            for name in ("cap", "krn", "xml")}
+
+
+STAGES = dict(
+    pcvs_2=Stage(
+        command=["02_make_pcvs.py"],
+        env=dict(N_MCS="2", READ_SCORES="0"),
+        outputs=pcv_outputs("tpc_2_pcvs"),
+        seconds=90,
+        megabytes=600,
+    ),
+    pcvs_2_scores=Stage(
+        command=["02_make_pcvs.py"],
+        env=dict(N_MCS="2", READ_SCORES="1"),
+        outputs=pcv_outputs("tpc_2_pcvs"),
+        seconds=45,
+        megabytes=400,
+    ),
+    pcvs_full=Stage(
+        command=["02_make_pcvs.py"],
+        env=dict(N_MCS="0", READ_SCORES="0"),
+        outputs=pcv_outputs("tpc_pcvs"),
+        seconds=90,
+        megabytes=600,
+    ),
+    compare_pcvs=Stage(
+        command=["03_compare_pcvs.py"],
+        outputs={
+            os.path.join("code", "groundtruth_pcvs.csv"): os.path.join("code", "groundtruth_pcvs.csv"),
+            "aligned_files.csv": "aligned_files.csv",
+        },
+        seconds=10,
+        megabytes=300,
+    ),
+    compare_measure_maps=Stage(
+        command=["-c", "import runpy; "
+                       "runpy.run_path('04_compare_measure_maps.py')['summaries_df'].to_csv('summaries_df.csv')"],
+        outputs={os.path.join("code", "summaries_df.csv"): os.path.join("code", "golden", "summaries_df.csv")},
+        seconds=10,
+        megabytes=300,
+    ),
+    convert=Stage(
+        command=["check_convert.py"],
+        outputs={},
+        seconds=20,
+        megabytes=200,
+    ),
+)
+
+
+class StageResult(NamedTuple):
+    stage: str
+    returncode: int
+    seconds: float
+    megabytes: float
+    differences: Dict[str, str]
+    """{golden path -> description} for each output that differs from its golden file."""
+    log_path: str
+
+    def failures(self, stage: Stage) -> List[str]:
+        failures = []
+        if self.returncode != 0:
+            failures.append(f"exited with code {self.returncode} (see {self.log_path})")
+        if self.seconds > stage.seconds:
+            failures.append(f"took {self.seconds:.1f} s > {stage.seconds} s")
+        if self.megabytes > stage.megabytes:
+            failures.append(f"used {self.megabytes:.0f} MB > {stage.megabytes} MB")
+        failures.extend(f"{path}: {description}" for path, description in self.differences.items())
+        return failures
+
+
+def make_scratch_copy(target: str) -> str:
+    """Copies the code and the CSV files to the target folder and links the data folder. Returns the target."""
+    shutil.copytree(os.path.join(REPO_FOLDER, "code"), os.path.join(target, "code"),
+                    ignore=shutil.ignore_patterns("__pycache__", ".ipynb_checkpoints", ".metadata_cache", "*.ipynb"))
+    shutil.copy2(os.path.join(REPO_FOLDER, "aligned_files.csv"), target)
+    os.symlink(os.path.join(REPO_FOLDER, "data"), os.path.join(target, "data"))
+    return target
+
+
+def run_command(command: List[str], cwd: str, env: Dict[str, str], log_path: str, timeout: float):
+    """Runs the Python command and returns (returncode, seconds, peak resident memory in MB). The process is killed
+    after `timeout` seconds."""
+    with open(log_path, "w", encoding="utf-8") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable] + command, cwd=cwd, env={**os.environ, **env},
+                                   stdout=log, stderr=subprocess.STDOUT)
+        timer = threading.Timer(timeout, process.kill)
+        timer.start()
+        try:
+            # wait4() returns the resource usage of this particular child
+            _, status, rusage = os.wait4(process.pid, 0)
+        finally:
+            timer.cancel()
+        seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    return process.returncode, seconds, max_rss / 2 ** 20
+
+
+def describe_differences(output_path: str, golden_path: str, atol: float = 0.0) -> Optional[str]:
+    """Returns None if both CSV files contain the same values (numbers are compared as floats, with the absolute
+    tolerance `atol`), otherwise a short description of the differences."""
+    if not os.path.isfile(output_path):
+        return "output missing"
+    if not os.path.isfile(golden_path):
+        return "golden file missing (use --update to create it)"
+    with open(output_path, "rb") as f, open(golden_path, "rb") as g:
+        if f.read() == g.read():
+            return None
+    output = pd.read_csv(output_path, header=None, dtype=str, keep_default_na=False)
+    golden = pd.read_csv(golden_path, header=None, dtype=str, keep_default_na=False)
+    if output.shape != golden.shape:
+        return f"shape {output.shape} instead of {golden.shape}"
+    output_numbers = output.apply(pd.to_numeric, errors="coerce")
+    golden_numbers = golden.apply(pd.to_numeric, errors="coerce")
+    both_numeric = output_numbers.notna() & golden_numbers.notna()
+    differs = ((output_numbers - golden_numbers).abs() > atol) & both_numeric
+    differs |= (output != golden) & ~both_numeric
+    if not differs.any(axis=None):
+        return None
+    cells = differs.stack()
+    cells = cells[cells].index
+    examples = ", ".join(f"{golden.iloc[row, 0]!r}/{golden.iloc[0, col]!r}: {golden.iloc[row, col]!r} -> "
+                         f"{output.iloc[row, col]!r}" for row, col in cells[:3])
+    n_rows = len(set(row for row, _ in cells))
+    return f"{len(cells)} values in {n_rows} rows differ, e.g. {examples}"
+
+
+def run_stage(name: str, scratch: str, atol: float = 0.0) -> StageResult:
+    stage = STAGES[name]
+    for output in stage.outputs:
+        output_path = os.path.join(scratch, output)
+        if os.path.isfile(output_path):
+            os.remove(output_path)
+    log_path = os.path.join(scratch, f"{name}.log")
+    returncode, seconds, megabytes = run_command(stage.command, os.path.join(scratch, "code"), stage.env, log_path,
+                                                 timeout=TIMEOUT_FACTOR * stage.seconds)
+    differences = {}
+    for output, golden in stage.outputs.items():
+        description = describe_differences(os.path.join(scratch, output), os.path.join(REPO_FOLDER, golden), atol)
+        if description is not None:
+            differences[golden] = description
+    return StageResult(name, returncode, seconds, megabytes, differences, log_path)
+
+
+def update_golden_files(name: str, scratch: str):
+    for output, golden in STAGES[name].outputs.items():
+        output_path = os.path.join(scratch, output)
+        if os.path.isfile(output_path):
+            golden_path = os.path.join(REPO_FOLDER, golden)
+            os.makedirs(os.path.dirname(golden_path), exist_ok=True)
+            shutil.copy2(output_path, golden_path)
+            print(f"Updated {golden}")
+
+
+def main(args: argparse.Namespace) -> int:
+    stages = args.stages or list(STAGES)
+    unknown = [name for name in stages if name not in STAGES]
+    if unknown:
+        print(f"Unknown stages {unknown}. Available: {list(STAGES)}")
+        return 2
+    scratch = make_scratch_copy(tempfile.mkdtemp(prefix="regression_"))
+    rows, failed = [], False
+    try:
+        for name in stages:
+            print(f"Running {name}...", flush=True)
+            result = run_stage(name, scratch, atol=args.atol)
+            failures = result.failures(STAGES[name])
+            for failure in failures:
+                print(f"\t{failure}")
+            if args.update and result.returncode == 0 and result.differences:
+                update_golden_files(name, scratch)
+            failed |= bool(failures)
+            rows.append(dict(stage=name, seconds=round(result.seconds, 1), budget_s=STAGES[name].seconds,
+                             MB=round(result.megabytes), budget_MB=STAGES[name].megabytes,
+                             outputs_differing=len(result.differences), status="FAILED" if failures else "OK"))
+    finally:
+        if args.keep:
+            print(f"Kept the scratch copy with the outputs and logs in {scratch}")
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+    print()
+    print(pd.DataFrame(rows).set_index("stage").to_string())
+    return 1 if failed else 0
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Runs the pipeline stages against the bundled data and compares "
+                                                 "their outputs with the committed ones.")
+    parser.add_argument("-s", "--stages", nargs="+", help=f"Stages to run, in this order. Defaults to all of "
+                                                          f"{list(STAGES)}.")
+    parser.add_argument("--atol", type=float, default=0.0, help="Absolute tolerance for numerical differences.")
+    parser.add_argument("--update", action="store_true", help="Overwrite the golden files with differing outputs.")
+    parser.add_argument("--keep", action="store_true", help="Do not delete the scratch copy.")
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(main(get_arg_parser().parse_args()))
@@ -0,0 +1,244 @@
+"""This file contains a lightweight alternative to the notes TSV files extracted by ms3. It streams the XML inside
+MuseScore 4 (`.mscz`, `.mscx`) and MusicXML (`.mxl`, `.musicxml`, `.xml`) files and yields only the columns needed for
+computing pitch-class vectors (see get_pcv() in 02_make_pcvs.py):
+
+* `mc`: measure count, i.e. the position of the measure in the score, starting from 1
+* `mc_onset`: the note's onset within the measure, in whole notes
+* `mn_onset`: the same, but counted from the nominal beginning of the measure if the first measure is an anacrusis
+* `staff`: starting from 1
+* `duration_qb`: the note's duration in quarter notes (0.0 for grace notes, like ms3)
+* `tpc`: tonal pitch class (0=C, 1=G, -1=F, etc.)
+* `quarterbeats_all_endings`: the note's onset in quarter notes from the beginning of the score, counting all endings
+
+Since both formats list one staff (part) after the other, reading stops as soon as the last staff has passed the
+requested number of measures.
+"""
+
+import os
+import xml.etree.ElementTree as ET
+import zipfile
+from fractions import Fraction
+from functools import lru_cache
+from operator import itemgetter
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+COLUMNS = ['mc', 'mc_onset', 'mn_onset', 'staff', 'duration_qb', 'tpc', 'quarterbeats_all_endings']
+
+DURATION_TYPES = {
+    'long': Fraction(4),
+    'breve': Fraction(2),
+    'whole': Fraction(1),
+    'half': Fraction(1, 2),
+    'quarter': Fraction(1, 4),
+    'eighth': Fraction(1, 8),
+    '16th': Fraction(1, 16),
+    '32nd': Fraction(1, 32),
+    '64th': Fraction(1, 64),
+    '128th': Fraction(1, 128),
+    '256th': Fraction(1, 256),
+}
+
+MSCX_GRACE_TAGS = {'acciaccatura', 'appoggiatura', 'grace4', 'grace8after', 'grace16', 'grace16after', 'grace32',
+                   'grace32after'}
+
+STEP2TPC = dict(F=-1, C=0, G=1, D=2, A=3, E=4, B=5)
+
+
+@lru_cache(maxsize=None)
+def dotted(duration: Fraction, dots: int) -> Fraction:
+    return duration * (2 - Fraction(1, 2 ** dots))
+
+
+def open_score(filepath: str) -> IO[bytes]:
+    """Returns a binary file object for the XML contained in a (zipped) score file."""
+    if not zipfile.is_zipfile(filepath):
+        return open(filepath, 'rb')
+    archive = zipfile.ZipFile(filepath)
+    names = archive.namelist()
+    mscx = [name for name in names if name.endswith('.mscx')]
+    if mscx:
+        return archive.open(mscx[0])
+    # MusicXML: the first rootfile declared in META-INF/container.xml
+    container = ET.fromstring(archive.read('META-INF/container.xml'))
+    rootfile = next(elem for elem in container.iter() if elem.tag.endswith('rootfile'))
+    return archive.open(rootfile.get('full-path'))
+
+
+def iter_mscx_notes(source: IO[bytes],
+                    measures: Dict[int, Tuple[Fraction, Fraction]],
+                    max_mc: Optional[int] = None) -> Iterator[tuple]:
+    """Yields (mc, mc_onset, staff, duration, tpc) for each note head in MuseScore 4 XML and fills `measures` with
+    {mc -> (actual length, time signature)}. Tuplets are expected in the MuseScore 4 encoding, i.e. a <Tuplet> element
+    followed by the tuplet's chords and an <endTuplet/>."""
+    path: List[str] = []
+    n_staves, staff, mc = 0, 0, 0
+    measure_skipped = False
+    timesig = Fraction(1)
+    position = Fraction(0)
+    tuplet_factors: List[Fraction] = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            parent = path[-1] if path else None
+            path.append(tag)
+            if tag == 'Staff':
+                if parent == 'Part':
+                    n_staves += 1
+                elif parent == 'Score':
+                    staff += 1
+                    mc = 0
+            elif tag == 'Measure' and parent == 'Staff':
+                mc += 1
+                measure_skipped = max_mc is not None and mc > max_mc
+                if measure_skipped and staff >= n_staves:
+                    break
+                if staff == 1:
+                    # the len attribute is present only when the actual length differs from the time signature;
+                    # TimeSig elements come later, hence the length is completed at the end of the measure
+                    measures[mc] = (elem.get('len'), None)
+            elif tag == 'voice':
+                position = Fraction(0)
+                tuplet_factors = []
+            continue
+        path.pop()
+        parent = path[-1] if path else None
+        if parent == 'Staff' and tag == 'Measure':
+            if staff == 1 and mc in measures:
+                act_dur = measures[mc][0]
+                measures[mc] = (timesig if act_dur is None else Fraction(act_dur), timesig)
+            elem.clear()
+            continue
+        if parent != 'voice' or measure_skipped:
+            continue
+        if tag == 'TimeSig':
+            timesig = Fraction(int(elem.findtext('sigN')), int(elem.findtext('sigD')))
+        elif tag == 'location':
+            position += Fraction(elem.findtext('fractions', '0'))
+        elif tag == 'Tuplet':
+            tuplet_factors.append(Fraction(int(elem.findtext('normalNotes')), int(elem.findtext('actualNotes'))))
+        elif tag == 'endTuplet':
+            if tuplet_factors:
+                tuplet_factors.pop()
+        elif tag in ('Chord', 'Rest'):
+            duration_type = elem.findtext('durationType')
+            if duration_type == 'measure':
+                duration = Fraction(elem.findtext('duration', '0'))
+            else:
+                duration = dotted(DURATION_TYPES[duration_type], int(elem.findtext('dots', '0')))
+                for factor in tuplet_factors:
+                    duration *= factor
+            if tag == 'Chord':
+                is_grace = any(child.tag in MSCX_GRACE_TAGS for child in elem)
+                note_duration = Fraction(0) if is_grace else duration
+                for note in elem.iterfind('Note'):
+                    yield mc, position, staff, note_duration, int(note.findtext('tpc')) - 14
+                if is_grace:
+                    continue
+            position += duration
+
+
+def iter_musicxml_notes(source: IO[bytes],
+                        measures: Dict[int, Tuple[Fraction, Fraction]],
+                        max_mc: Optional[int] = None) -> Iterator[tuple]:
+    """Yields (mc, mc_onset, staff, duration, tpc) for each pitched note in partwise MusicXML and fills `measures`
+    with {mc -> (actual length, time signature)}."""
+    path: List[str] = []
+    n_parts, part, mc = 0, 0, 0
+    first_staff, n_part_staves = 1, 1
+    measure_skipped = False
+    divisions = 1
+    timesig = Fraction(1)
+    position = measure_end = last_onset = Fraction(0)
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            parent = path[-1] if path else None
+            path.append(tag)
+            if tag == 'score-part':
+                n_parts += 1
+            elif tag == 'part' and parent == 'score-partwise':
+                part += 1
+                if part > 1:
+                    first_staff += n_part_staves
+                n_part_staves = 1
+                mc = 0
+            elif tag == 'measure' and parent == 'part':
+                mc += 1
+                measure_skipped = max_mc is not None and mc > max_mc
+                if measure_skipped and part >= n_parts:
+                    break
+                position = measure_end = last_onset = Fraction(0)
+            continue
+        path.pop()
+        parent = path[-1] if path else None
+        if tag == 'measure' and parent == 'part':
+            if part == 1 and not measure_skipped:
+                measures[mc] = (measure_end, timesig)
+            elem.clear()
+            continue
+        if measure_skipped or parent != 'measure':
+            continue
+        if tag == 'attributes':
+            divisions = int(elem.findtext('divisions', str(divisions)))
+            n_part_staves = int(elem.findtext('staves', str(n_part_staves)))
+            time = elem.find('time')
+            if time is not None and time.findtext('beats'):
+                timesig = Fraction(int(time.findtext('beats')), int(time.findtext('beat-type')))
+        elif tag in ('backup', 'forward'):
+            shift = Fraction(int(elem.findtext('duration')), 4 * divisions)
+            position += -shift if tag == 'backup' else shift
+        elif tag == 'note':
+            is_grace = elem.find('grace') is not None
+            is_chord = elem.find('chord') is not None
+            duration = Fraction(0) if is_grace else Fraction(int(elem.findtext('duration', '0')), 4 * divisions)
+            if not is_chord:
+                last_onset = position
+                position += duration
+            pitch = elem.find('pitch')
+            if pitch is not None:
+                tpc = STEP2TPC[pitch.findtext('step')] + 7 * int(float(pitch.findtext('alter', '0')))
+                staff = first_staff + int(elem.findtext('staff', '1')) - 1
+                yield mc, last_onset, staff, duration, tpc
+            measure_end = max(measure_end, position)
+
+
+def get_anacrusis_offset(measures: Dict[int, Tuple[Fraction, Fraction]]) -> Fraction:
+    """Returns the difference between mn_onset and mc_onset in the first measure. Like ms3, an incomplete first
+    measure is considered an anacrusis unless it is completed by the second measure (split measure)."""
+    if 1 not in measures:
+        return Fraction(0)
+    act_dur, timesig = measures[1]
+    if act_dur >= timesig:
+        return Fraction(0)
+    if 2 in measures:
+        next_act_dur, next_timesig = measures[2]
+        if next_act_dur < next_timesig and act_dur + next_act_dur == timesig:
+            return Fraction(0)
+    return timesig - act_dur
+
+
+def load_score_notes(filepath: str, max_mc: Optional[int] = None) -> pd.DataFrame:
+    """Reads the notes of the first `max_mc` measures (all if None) from a MuseScore 4 or MusicXML file into a
+    DataFrame with the columns described at the top of this file, sorted by mc, mc_onset, and staff.
+    """
+    ext = os.path.splitext(filepath)[1].lower()
+    iter_notes = iter_mscx_notes if ext in ('.mscz', '.mscx') else iter_musicxml_notes
+    # the second measure is needed for telling an anacrusis from a split measure
+    read_mcs = None if max_mc is None else max(max_mc, 2)
+    measures = {}
+    with open_score(filepath) as source:
+        rows = [row for row in iter_notes(source, measures, max_mc=read_mcs) if max_mc is None or row[0] <= max_mc]
+    offset = get_anacrusis_offset(measures)
+    mc_offsets, position = {}, Fraction(0)
+    for mc in sorted(measures):
+        mc_offsets[mc] = position
+        position += measures[mc][0]
+    rows.sort(key=itemgetter(0, 1, 2))
+    df = pd.DataFrame(
+        [(mc, mc_onset, mc_onset + offset if mc == 1 else mc_onset, staff, float(duration * 4), tpc,
+          4 * (mc_offsets[mc] + mc_onset))
+         for mc, mc_onset, staff, duration, tpc in rows],
+        columns=COLUMNS)
+    return df
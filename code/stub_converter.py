@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""This file is a stand-in for the external converters called by convert.py (hum2xml, MuseScore, MM, ms3), for
+testing the conversion stage without installing them. It accepts their command lines and
+
+* with `-o <file>` (MuseScore), writes a file containing the name and contents of the source (the last argument);
+* with `-o <folder>` (MM), creates the folder and writes `stub.txt` into it;
+* with `-M <folder> ... -N <folder>` (ms3), creates these folders below the `-d` folder;
+* otherwise (hum2xml), prints the contents of the source to stdout.
+
+Its behaviour can be controlled through environment variables:
+
+* STUB_LOG: path of a file to which the process ID and the arguments of each call are appended;
+* STUB_SLEEP: seconds to sleep before converting (for testing timeouts);
+* STUB_FAIL_ONCE: path of a folder; the first call with a given command line fails with exit code 1 and leaves a
+  marker in this folder, repeated calls succeed (for testing retries).
+"""
+
+import hashlib
+import os
+import sys
+import time
+from typing import List, Optional
+
+
+def get_option(args: List[str], option: str) -> Optional[str]:
+    if option in args[:-1]:
+        return args[args.index(option) + 1]
+    return None
+
+
+def main(args: List[str]) -> int:
+    log_path = os.environ.get("STUB_LOG")
+    if log_path:
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(f"{os.getpid()}\t{' '.join(args)}\n")
+    fail_once = os.environ.get("STUB_FAIL_ONCE")
+    if fail_once:
+        marker = os.path.join(fail_once, hashlib.sha1("\0".join(args).encode()).hexdigest())
+        if not os.path.exists(marker):
+            os.makedirs(fail_once, exist_ok=True)
+            open(marker, "w").close()
+            print("Failing on the first attempt (STUB_FAIL_ONCE).", file=sys.stderr)
+            return 1
+    time.sleep(float(os.environ.get("STUB_SLEEP", 0)))
+    if not args:
+        print("No arguments given.", file=sys.stderr)
+        return 2
+    output = get_option(args, "-o")
+    if output is not None and os.path.splitext(output)[1]:
+        source = args[-1]
+        with open(source, "r", encoding="utf-8") as f:
+            contents = f.read()
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(f"converted {os.path.basename(source)}\n{contents}")
+    elif output is not None:
+        os.makedirs(output, exist_ok=True)
+        with open(os.path.join(output, "stub.txt"), "w", encoding="utf-8") as f:
+            f.write(" ".join(args))
+    elif get_option(args, "-d") is not None:
+        directory = get_option(args, "-d")
+        for option in ("-M", "-MM", "-N"):
+            folder = get_option(args, option)
+            if folder is not None:
+                os.makedirs(os.path.join(directory, folder), exist_ok=True)
+    else:
+        with open(args[-1], "r", encoding="utf-8") as f:
+            sys.stdout.write(f.read())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
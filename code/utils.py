@@ -1,6 +1,28 @@
 """This file contains functions used by several scripts/notebooks."""
 
+import hashlib
 import os
+from typing import Iterable, Optional, Tuple
+
+
+def parse_cpe_filename(fname: str, extension: str = '') -> Optional[Tuple[int, str]]:
+    """Parses a DCML filename such as '283bis Herr Jesu Christ, wahr Mensch und Gott.mscx' into the corrected CPE
+    number and the title. Corrects the error in the CPE numbering by turning the duplicate "283bis" into 284 and
+    correcting all following 284, 285... by +1. Returns None if the filename does not start with a number.
+    """
+    if not fname[:3].isdigit():
+        return None
+    number = int(fname[:3])
+    l_ext = len(extension)
+    title = fname[4:len(fname) - l_ext]
+    if number > 282:
+        if number == 283:
+            if fname[:6] == '283bis':
+                number += 1
+                title = fname[7:len(fname) - l_ext]
+        else:
+            number += 1
+    return number, title
 
 
 def get_dcml_files(path, extension='.tsv', remove_extension=True):
@@ -8,23 +30,31 @@ def get_dcml_files(path, extension='.tsv', remove_extension=True):
     following 284, 285... by +1
     """
     number2file = {}
-    for fname in os.listdir(path):
-        if not fname.endswith(extension):
-            continue
-        number = int(fname[:3])
-        l_ext = len(extension)
-        title = fname[4:-l_ext]
-        if number > 282:
-            if number == 283:
-                if fname[:6] == '283bis':
-                    number += 1 
-                    title = fname[7:-l_ext]
-                else:
-                    pass
-            else:
-                number += 1
-        if remove_extension:
-            fname = fname[:-l_ext]
-        number2file[number] = (fname, title)
+    with os.scandir(path) as entries:
+        for entry in entries:
+            fname = entry.name
+            if not fname.endswith(extension):
+                continue
+            parsed = parse_cpe_filename(fname, extension)
+            if parsed is None:
+                continue
+            number, title = parsed
+            if remove_extension:
+                fname = fname[:len(fname) - len(extension)]
+            number2file[number] = (fname, title)
     result = {i: number2file.get(i) for i in range(1, 372)}
-    return result
\ No newline at end of file
+    return result
+
+
+def hash_sources(sources: Iterable[str]) -> str:
+    """Hashes the names and contents of the source files; missing files hash as empty."""
+    h = hashlib.sha1()
+    for source in sources:
+        h.update(os.path.basename(source).encode())
+        try:
+            with open(source, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 16), b""):
+                    h.update(chunk)
+        except FileNotFoundError:
+            h.update(b"\0")
+    return h.hexdigest()